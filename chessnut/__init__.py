@@ -1,3 +1,5 @@
+import os
+
 from pyramid.config import Configurator
 from sqlalchemy import engine_from_config
 from pyramid_beaker import session_factory_from_settings
@@ -9,6 +11,21 @@ from .models import (
     Base,
     )
 
+from . import (
+    dispatch,
+    error_replies,
+    generate_board,
+    identities,
+    media,
+    outbox,
+    pipeline,
+    render_cache,
+    render_pool,
+    timing,
+    twitter,
+    views,
+    )
+
 from .security import (
     Root,
     # UserFactory,
@@ -22,6 +39,20 @@ def main(global_config, **settings):
     engine = engine_from_config(settings, 'sqlalchemy.')
     DBSession.configure(bind=engine)
     Base.metadata.bind = engine
+    render_cache.configure(settings)
+    render_pool.configure(settings)
+    generate_board.configure(settings)
+    twitter.configure(settings)
+    identities.configure(settings)
+    media.configure(settings)
+    outbox.configure(settings)
+    error_replies.configure(settings)
+    dispatch.configure(settings)
+    pipeline.configure(settings)
+    timing.configure(settings)
+    #fork the render workers, with everything above configured, before the
+    #threads views.configure starts can hold locks the workers would copy
+    render_pool.get_pool()
     authentication_policy = AuthTktAuthenticationPolicy('somesecret')
     authorization_policy = ACLAuthorizationPolicy()
     session_factory = session_factory_from_settings(settings)
@@ -37,6 +68,9 @@ def main(global_config, **settings):
 
     # views
     config.add_static_view('static', 'static', cache_max_age=3600)
+    config.add_static_view('boards',
+                           os.path.abspath(render_cache.cache.directory),
+                           cache_max_age=3600)
     config.add_route('home', '/')
     config.add_route('login', '/login')
     config.add_route('logout', '/logout')
@@ -44,5 +78,8 @@ def main(global_config, **settings):
     config.add_route('index', '/index')
     config.add_route('register', '/register')
     config.add_route('mentions', '/mentions')
+    config.add_route('replay', '/games/{name}/replay.gif')
+    config.add_route('metrics', '/metrics')
     config.scan()
+    views.configure(settings)
     return config.make_wsgi_app()
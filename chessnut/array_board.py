@@ -0,0 +1,87 @@
+"""NumPy compositing backend for board rendering.
+
+The board and sprites are held as integer arrays, with each sprite
+premultiplied by its alpha, and every occupied square is blended at once. The
+blend rounds exactly as PIL's Image.paste does, so boards match the PIL
+renderer in generate_board pixel for pixel.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from PIL import Image
+
+from .generate_board import element, glows, pieces
+
+_layers = None
+
+
+def _muldiv255(a, b):
+    tmp = a * b + 128
+    return ((tmp >> 8) + tmp) >> 8
+
+
+def _layer(src, mask):
+    """Returns the (premultiplied source, inverse alpha) pair that blends
+    src through mask's alpha.
+    """
+    alpha = numpy.asarray(mask, dtype=numpy.uint16)[:, :, 3:4]
+    src = numpy.asarray(src, dtype=numpy.uint16)
+    return _muldiv255(src, alpha), numpy.repeat(255 - alpha, 4, axis=2)
+
+
+def _load():
+    """Loads the base board and premultiplied sprites, indexed by the
+    characters of an image string ('0' being a transparent sprite).
+    """
+    global _layers
+    if _layers is None:
+        base = numpy.asarray(element('board').convert('RGBA'),
+                             dtype=numpy.uint16)
+        glow = element('glow')
+        codes = '0' + ''.join(pieces) + ''.join(pieces).upper()
+        premul = numpy.zeros((len(codes), 58, 58, 4), dtype=numpy.uint16)
+        inverse = numpy.empty((len(codes), 58, 58, 4), dtype=numpy.uint16)
+        inverse.fill(255)
+        for i, code in enumerate(codes[1:], 1):
+            p = element(pieces[code.lower()]).convert('RGBA')
+            if code.isupper():
+                src = numpy.empty((58, 58, 4), dtype=numpy.uint16)
+                src[:] = (91, 94, 243, 255)
+            else:
+                src = p
+            premul[i], inverse[i] = _layer(src, p)
+        _layers = {
+            'base': base,
+            'glow': _layer(glow.convert('RGBA'), glow),
+            'index': dict((code, i) for i, code in enumerate(codes)),
+            'premul': premul,
+            'inverse': inverse,
+        }
+    return _layers
+
+
+def _blend(dst, premul, inverse):
+    return _muldiv255(dst, inverse) + premul
+
+
+def render(state):
+    """Renders the image string state and returns it as a PIL image."""
+    if numpy is None:
+        raise ImportError("The numpy board backend needs numpy installed.")
+    layers = _load()
+    BOARD = layers['base'].copy()
+    #view the 8x8 grid of 58 pixel squares as an (8, 8, 58, 58, 4) array
+    grid = BOARD[11:11 + 464, 26:26 + 464].reshape(8, 58, 8, 58, 4)
+    squares = grid.transpose(0, 2, 1, 3, 4).copy()
+    for c, r in glows(state):
+        squares[r, c] = _blend(squares[r, c], *layers['glow'])
+    codes = numpy.array([layers['index'][i] for i in state[:64]])
+    codes = codes.reshape(8, 8)
+    occupied = codes != 0
+    squares[occupied] = _blend(squares[occupied],
+                               layers['premul'][codes[occupied]],
+                               layers['inverse'][codes[occupied]])
+    grid[:] = squares.transpose(0, 2, 1, 3, 4)
+    return Image.fromarray(BOARD.astype(numpy.uint8), 'RGBA')
@@ -900,6 +900,18 @@ class ChessnutGame(object):
         return board
 
 
+def positions(game):
+    """Walks a PGN-represented game from the initial position, yielding
+    the image string after every half move.
+    """
+    chessnut_game = ChessnutGame()
+    for move in re.split(r'\s?\d+\.\s', game.rstrip())[1:]:
+        for half_move in move.split():
+            chessnut_game.evaluate_move(half_move)
+            chessnut_game.turn = not chessnut_game.turn
+            yield chessnut_game.image_string
+
+
 class ChessnutError(BaseException):
     """Chessnut base exception."""
     pass
@@ -0,0 +1,52 @@
+import threading
+
+#TwUser id of the account the app tweets as
+BOT = 1
+
+
+class ClientRegistry(object):
+    """Thread-safe cache of one authenticated API client per TwUser.
+
+    factory(key, secret) builds a client from a user's access token. A
+    cached client is rebuilt as soon as it's asked for with different
+    tokens. The bot's client is also found without looking its TwUser up,
+    so it has to be invalidated when the bot's tokens change.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.stats = {'hits': 0, 'builds': 0}
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def get(self, user):
+        """Returns the client for TwUser user."""
+        tokens = (user.key, user.secret)
+        with self._lock:
+            cached = self._clients.get(user.id)
+            if cached is not None and cached[0] == tokens:
+                self.stats['hits'] += 1
+                return cached[1]
+            self.stats['builds'] += 1
+            client = self.factory(*tokens)
+            self._clients[user.id] = (tokens, client)
+            return client
+
+    def bot(self, lookup):
+        """Returns the bot's client, calling lookup(BOT) for its TwUser
+        only if it isn't cached.
+        """
+        with self._lock:
+            cached = self._clients.get(BOT)
+            if cached is not None:
+                self.stats['hits'] += 1
+                return cached[1]
+        return self.get(lookup(BOT))
+
+    def invalidate(self, user_id=None):
+        """Forgets the client of TwUser id user_id, or every client."""
+        with self._lock:
+            if user_id is None:
+                self._clients.clear()
+            else:
+                self._clients.pop(user_id, None)
@@ -0,0 +1,160 @@
+import logging
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import transaction
+
+from .models import DBSession
+from .prefetch import Batch
+from .twitter import parse, play
+
+
+log = logging.getLogger(__name__)
+
+#lane of the tweets that aren't moves: challenges and malformed tweets
+CONTROL = None
+
+
+def lane(tweet):
+    """Returns the #game tag a tweet moves in, or CONTROL."""
+    parsed = parse(tweet)
+    if parsed is None or parsed['opponent']:
+        return CONTROL
+    return parsed['game']
+
+
+def process(tweets):
+    """Plays a lane's tweets, each in its own transaction so a crash only
+    replays the one it interrupted, and returns the (image string, previous
+    image string, mention id) of the boards they played.
+    The users, games and challenges they refer to are loaded up front.
+    A tweet that can't be played is logged and left with unplayed set to
+    'failed'. The rest of a game's lane after it are left 'stalled', for a
+    later poll to play them again in order.
+    """
+    #keeps the prefetched rows loaded between the tweets' commits; the
+    #session is thrown away after the lane so they can't go stale
+    DBSession().expire_on_commit = False
+    ordered = lane(tweets[0]) != CONTROL
+    try:
+        with transaction.manager:
+            batch = Batch.load(tweets, parse)
+        boards = []
+        stalled = False
+        for tweet in tweets:
+            if stalled:
+                tweet.unplayed = 'stalled'
+                continue
+            try:
+                with transaction.manager:
+                    batch.attach()
+                    played = play(tweet, batch)
+            except Exception:
+                log.exception("couldn't play tweet %s", tweet.id)
+                tweet.unplayed = 'failed'
+                stalled = ordered
+                continue
+            if played is not None:
+                boards.append(played + (tweet.id,))
+        return boards
+    finally:
+        DBSession.remove()
+
+
+class Dispatcher(object):
+    """Processes a batch of mentions one lane per game, lanes running
+    concurrently on a pool of worker threads.
+
+    Within a lane tweets are handled in tweet id order, each lane in a
+    transaction of its own. Challenges and malformed tweets share the
+    CONTROL lane; a game challenged in the batch only has its moves played
+    once that lane is done, so an accepted challenge's game exists first.
+    """
+
+    def __init__(self, workers=4, process=process):
+        self.workers = workers
+        self.process = process
+        self.stats = {'batches': 0, 'tweets': 0, 'lanes': 0, 'failed': 0,
+                      'unplayed': 0}
+        self._pool = None
+
+    def partition(self, tweets):
+        """Returns an OrderedDict of lane to its tweets, in id order."""
+        lanes = OrderedDict()
+        for tweet in sorted(tweets, key=lambda t: t.id):
+            lanes.setdefault(lane(tweet), []).append(tweet)
+        return lanes
+
+    def _run(self, key, tweets, after=None, done=None):
+        """Processes a lane once after (an Event) is set, and sets done.
+        Returns the boards it played.
+        """
+        if after is not None:
+            after.wait()
+        try:
+            return self.process(tweets) or []
+        except Exception:
+            self.stats['failed'] += 1
+            log.exception("couldn't process lane #%s", key)
+            for tweet in tweets:
+                tweet.unplayed = 'failed'
+            return []
+        finally:
+            if done is not None:
+                done.set()
+
+    def dispatch(self, tweets):
+        """Processes tweets and blocks until every lane is done. Returns
+        the (image string, previous image string, mention id) of every board
+        played.
+        Tweets that weren't played are left with unplayed set (see
+        process).
+        """
+        if self._pool is None:
+            self._pool = ThreadPool(self.workers)
+        lanes = self.partition(tweets)
+        tweets = sum(lanes.values(), [])
+        self.stats['batches'] += 1
+        self.stats['tweets'] += len(tweets)
+        self.stats['lanes'] += len(lanes)
+        results = []
+        control = None
+        challenged = set()
+        if CONTROL in lanes:
+            commands = lanes.pop(CONTROL)
+            #ApplyResult.wait only wakes one waiter in python 2
+            control = threading.Event()
+            results.append(self._pool.apply_async(
+                self._run, (CONTROL, commands, None, control)))
+            for tweet in commands:
+                if parse(tweet) is not None:
+                    challenged.add(parse(tweet)['game'])
+        for key, moves in lanes.items():
+            after = control if key in challenged else None
+            results.append(self._pool.apply_async(self._run,
+                                                  (key, moves, after)))
+        boards = []
+        for result in results:
+            boards.extend(result.get())
+        self.stats['unplayed'] += sum(1 for t in tweets
+                                      if hasattr(t, 'unplayed'))
+        return boards
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+dispatcher = Dispatcher()
+
+
+def configure(settings):
+    """Replaces the shared dispatcher with one of dispatch.workers
+    threads.
+    """
+    global dispatcher
+    dispatcher.close()
+    dispatcher = Dispatcher(int(settings.get('dispatch.workers') or 4))
+    return dispatcher
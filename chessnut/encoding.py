@@ -0,0 +1,87 @@
+import time
+from io import BytesIO
+from PIL import Image
+
+
+#name: (file extension, PIL format, whether a saved frame can be reused
+#for incremental rendering without its losses piling up)
+FORMATS = {
+    'png': ('png', 'PNG', True),
+    'png8': ('png', 'PNG', True),
+    'jpeg': ('jpg', 'JPEG', False),
+}
+
+_palette = None
+
+
+def palette():
+    """Returns a palette image shared by every png8 board.
+
+    The palette is quantized once from sample renders holding every piece
+    in both colours, with glowing squares under each, so quantizing a
+    board against it maps its few colours to the same entries every time.
+    Only 255 entries are used; the last repeats the first, so boards never
+    quantize to it and replays can use it as their transparent colour.
+    """
+    global _palette
+    if _palette is None:
+        from .generate_board import _full, start
+        white, black = _full(start + '4644'), _full(start + '4143')
+        sample = Image.new('RGB', (white.size[0] * 2, white.size[1]))
+        sample.paste(white.convert('RGB'), (0, 0))
+        sample.paste(black.convert('RGB'), (white.size[0], 0))
+        _palette = sample.quantize(255)
+        colours = _palette.getpalette()[:765]
+        _palette.putpalette(colours + colours[:3])
+    return _palette
+
+
+def quantize(image):
+    """Maps image onto the shared palette without dithering, so a square
+    comes out the same whether quantized alone or with the whole board.
+    """
+    image = image.convert('RGB')
+    image.load()
+    #Image.quantize always dithers against a given palette
+    return image._new(image.im.convert('P', 0, palette().im))
+
+
+def encode(image, f, fmt='png', compress_level=6, quality=85):
+    """Writes image to the file object f in the named format and returns
+    (bytes written, seconds taken).
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Unknown board format: %s" % fmt)
+    began, position = time.time(), f.tell()
+    if fmt == 'png':
+        image.save(f, 'PNG', compress_level=compress_level)
+    elif fmt == 'png8':
+        image = quantize(image)
+        image.save(f, 'PNG', compress_level=compress_level)
+    else:
+        image.convert('RGB').save(f, 'JPEG', quality=quality, optimize=True)
+    return f.tell() - position, time.time() - began
+
+
+def format_report(images, compress_level=6, quality=85):
+    """Encodes images in every format and returns, per format, the mean
+    size in bytes and mean encode time in milliseconds.
+    """
+    report = {}
+    for fmt in sorted(FORMATS):
+        size = seconds = 0
+        for image in images:
+            b, s = encode(image, BytesIO(), fmt, compress_level, quality)
+            size, seconds = size + b, seconds + s
+        report[fmt] = {'bytes': size // len(images),
+                       'ms': 1000.0 * seconds / len(images)}
+    return report
+
+
+if __name__ == '__main__':
+    from .chess import positions
+    from .generate_board import _full
+    images = [_full(state) for state in
+              positions('1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. O-O Nf6')]
+    for fmt, stats in sorted(format_report(images).items()):
+        print('%-5s %7d bytes %6.1f ms' % (fmt, stats['bytes'], stats['ms']))
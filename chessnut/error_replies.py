@@ -0,0 +1,92 @@
+"""Error replies owed to users, one reply per user per batch of mentions
+and none about an error they were told about recently. twitter.send_error
+adds to them and twitter.send_errors tweets them.
+"""
+import threading
+import time
+
+
+class ErrorReplies(object):
+    """The error replies users are owed, coalesced into one reply per user.
+
+    Errors are collected while a batch of mentions is played and taken
+    together afterwards, each user's in the order they were first raised.
+    An error's cooldown starts once the reply about it is told, and an
+    error the user was told about less than cooldown seconds ago is
+    dropped. post says whether the replies are tweeted at all.
+    """
+
+    def __init__(self, cooldown=3600, post=False):
+        self.cooldown = cooldown
+        self.post = post
+        self.stats = {'errors': 0, 'coalesced': 0, 'suppressed': 0,
+                      'replies': 0}
+        self._lock = threading.Lock()
+        #user id: errors owed, in order
+        self._owed = {}
+        #(user id, error): epoch second it may be sent again
+        self._told = {}
+
+    def add(self, user_id, error, now=None):
+        """Owes user_id a reply about error. Returns whether it's to be
+        sent, rather than already owed or still cooling down.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self.stats['errors'] += 1
+            if self._told.get((user_id, error), 0) > now:
+                self.stats['suppressed'] += 1
+                return False
+            owed = self._owed.setdefault(user_id, [])
+            if error in owed:
+                self.stats['coalesced'] += 1
+                return False
+            owed.append(error)
+            return True
+
+    def take(self):
+        """Returns and clears the (user id, errors) of every user owed a
+        reply. Each goes to told once its reply is sent, or to restore if
+        it isn't.
+        """
+        with self._lock:
+            owed, self._owed = self._owed, {}
+        return sorted(owed.items())
+
+    def told(self, user_id, errors, now=None):
+        """Records that user_id was replied to about errors, starting
+        their cooldowns.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            for key, until in self._told.items():
+                if until <= now:
+                    del self._told[key]
+            for error in errors:
+                self._told[(user_id, error)] = now + self.cooldown
+            self.stats['replies'] += 1
+
+    def restore(self, user_id, errors):
+        """Owes user_id errors again, ahead of any added since they were
+        taken, because the reply about them wasn't sent.
+        """
+        with self._lock:
+            owed = self._owed.get(user_id, [])
+            self._owed[user_id] = list(errors) + [e for e in owed
+                                                  if e not in errors]
+
+
+replies = ErrorReplies()
+
+
+def configure(settings):
+    """Replaces the shared error replies with ones built from the errors.*
+    keys.
+    """
+    global replies
+    replies = ErrorReplies(
+        int(settings.get('errors.cooldown') or 3600),
+        (settings.get('errors.post') or 'false').lower() == 'true')
+    return replies
@@ -0,0 +1,350 @@
+"""Local stand-in for the parts of the Twitter API chessnut talks to, for
+load tests and end to end runs that mustn't touch the real service.
+
+Point the app at one with twitter.api_host = 127.0.0.1:<port> and
+twitter.api_secure = false; scripts/loadtest.py runs one and feeds it
+mentions.
+"""
+import json
+import random
+import re
+import threading
+import time
+import urllib
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+#calls per rate limit window Twitter allows each account
+LIMITS = {
+    '/statuses/mentions_timeline.json': 15,
+    '/users/show.json': 180,
+    '/account/verify_credentials.json': 15,
+}
+
+
+def _error(code, message):
+    return {'errors': [{'code': code, 'message': message}]}
+
+
+class FakeTwitter(ThreadingMixIn, HTTPServer):
+    """Serves mentions_timeline, update_status, media/upload, get_user,
+    verify_credentials and the OAuth token dance from memory. Uploaded media
+    can be attached to its uploader's tweets for media_ttl seconds.
+
+    Each request is held for latency seconds, give or take up to jitter,
+    before it's answered. Requests whose OAuth header doesn't carry a known
+    access token are refused. The endpoints in limits allow each account
+    that many calls every window seconds, reporting what's left in the
+    x-rate-limit headers, and answer 429 once it's used up. Status ids
+    start from first_id.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, api_root='/1.1', latency=0,
+                 jitter=0, limits=None, window=900, first_id=1,
+                 media_ttl=86400):
+        HTTPServer.__init__(self, (host, port), Handler)
+        self.api_root = api_root
+        self.latency = latency
+        self.jitter = jitter
+        self.limits = LIMITS if limits is None else limits
+        self.window = window
+        self.media_ttl = media_ttl
+        #user id: screen name
+        self.users = {}
+        #access token key: user id
+        self.tokens = {}
+        self.statuses = []
+        #(time, user id, text, bytes of media) of every tweet posted
+        self.posted = []
+        #media id: (user id, bytes, epoch second it expires)
+        self.media = {}
+        self.stats = {'requests': 0, 'unauthorized': 0, 'throttled': 0,
+                      'uploads': 0, 'uploaded_bytes': 0}
+        self._windows = {}
+        self._request_tokens = {}
+        self.next_id = first_id
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def address(self):
+        return '%s:%s' % self.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name='fake-twitter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def add_user(self, user_id, screen_name, key=None):
+        """Registers an account, signed in as with access token key."""
+        with self._lock:
+            self.users[user_id] = screen_name
+            if key is not None:
+                self.tokens[key] = user_id
+
+    def user(self, user_id=None, screen_name=None):
+        """Returns the JSON of an account, or None if there's no such one."""
+        with self._lock:
+            if user_id is None:
+                for id, name in self.users.items():
+                    if name.lower() == (screen_name or '').lower():
+                        user_id = id
+            if user_id not in self.users:
+                return None
+            return {'id': user_id, 'id_str': str(user_id),
+                    'screen_name': self.users[user_id]}
+
+    def tweet(self, user_id, text):
+        """Posts text as user_id and returns its status JSON."""
+        mentions = []
+        for name in re.findall(r'@(\w+)', text):
+            mentioned = self.user(screen_name=name)
+            if mentioned is not None:
+                mentions.append(mentioned)
+        now = time.time()
+        with self._lock:
+            status = {
+                'id': self.next_id,
+                'id_str': str(self.next_id),
+                'text': text,
+                'created_at': time.strftime('%a %b %d %H:%M:%S +0000 %Y',
+                                            time.gmtime(now)),
+                'user': {'id': user_id, 'id_str': str(user_id),
+                         'screen_name': self.users.get(user_id)},
+                'entities': {'user_mentions': mentions},
+            }
+            self.next_id += 1
+            self.statuses.append(status)
+        return status
+
+    def mentions(self, user_id, since_id=None, max_id=None, count=20):
+        """Returns the statuses mentioning user_id, newest first."""
+        with self._lock:
+            statuses = list(self.statuses)
+        found = []
+        for status in reversed(statuses):
+            if since_id is not None and status['id'] <= since_id:
+                break
+            if max_id is not None and status['id'] > max_id:
+                continue
+            if user_id in [m['id'] for m in
+                           status['entities']['user_mentions']]:
+                found.append(status)
+                if len(found) == count:
+                    break
+        return found
+
+    def throttle(self, user_id, path):
+        """Counts a call to path by user_id. Returns whether it's allowed
+        and the rate limit headers to send with it.
+        """
+        limit = self.limits.get(path)
+        if limit is None:
+            return True, {}
+        now = time.time()
+        with self._lock:
+            start, calls = self._windows.get((user_id, path), (now, 0))
+            if now >= start + self.window:
+                start, calls = now, 0
+            allowed = calls < limit
+            if allowed:
+                calls += 1
+            else:
+                self.stats['throttled'] += 1
+            self._windows[(user_id, path)] = start, calls
+        return allowed, {
+            'x-rate-limit-limit': limit,
+            'x-rate-limit-remaining': limit - calls,
+            'x-rate-limit-reset': int(start + self.window),
+        }
+
+    def wait(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def oauth_params(header):
+    """Returns the parameters of an OAuth Authorization header."""
+    return dict((k, urllib.unquote(v)) for k, v in
+                re.findall(r'(\w+)="([^"]*)"', header or ''))
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload, headers=None, content_type=None):
+        if isinstance(payload, dict) or isinstance(payload, list):
+            payload, content_type = json.dumps(payload), 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type or 'text/plain')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, method):
+        server = self.server
+        server.wait()
+        with server._lock:
+            server.stats['requests'] += 1
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Type', '').startswith(
+                'application/x-www-form-urlencoded'):
+            params.update(urlparse.parse_qsl(body))
+        oauth = oauth_params(self.headers.get('Authorization'))
+        if url.path.startswith('/oauth/'):
+            return self._oauth(url.path[len('/oauth/'):], params, oauth)
+        path = url.path[len(server.api_root):]
+        route = ROUTES.get((method, path))
+        if not url.path.startswith(server.api_root) or route is None:
+            return self._send(404, _error(34, 'Sorry, that page does not '
+                                              'exist'))
+        user_id = server.tokens.get(oauth.get('oauth_token'))
+        if user_id is None:
+            with server._lock:
+                server.stats['unauthorized'] += 1
+            return self._send(401, _error(89, 'Invalid or expired token'))
+        allowed, headers = server.throttle(user_id, path)
+        if not allowed:
+            return self._send(429, _error(88, 'Rate limit exceeded'),
+                              headers)
+        status, payload = route(server, user_id, params, body)
+        self._send(status, payload, headers)
+
+    def _oauth(self, endpoint, params, oauth):
+        """Hands out a request token, signs whoever asks in as a new
+        account, or the one named by screen_name, and trades the request
+        token for that account's access token.
+        """
+        server = self.server
+        if endpoint == 'request_token':
+            token = 'request-%s' % random.getrandbits(64)
+            with server._lock:
+                server._request_tokens[token] = {
+                    'callback': oauth.get('oauth_callback'),
+                    'user_id': None}
+            return self._send(200, urllib.urlencode({
+                'oauth_token': token,
+                'oauth_token_secret': 'secret-%s' % token,
+                'oauth_callback_confirmed': 'true'}))
+        if endpoint in ('authorize', 'authenticate'):
+            request = server._request_tokens.get(params.get('oauth_token'))
+            if request is None:
+                return self._send(401, 'Invalid request token')
+            user = server.user(screen_name=params.get('screen_name'))
+            if user is None:
+                with server._lock:
+                    user_id = max(server.users.keys() + [0]) + 1
+                server.add_user(user_id, params.get('screen_name') or
+                                'player%s' % user_id)
+            else:
+                user_id = user['id']
+            request['user_id'] = user_id
+            verifier = 'verifier-%s' % user_id
+            request['verifier'] = verifier
+            callback = request['callback']
+            if not callback or callback == 'oob':
+                return self._send(200, verifier)
+            self.send_response(302)
+            self.send_header('Location', '%s%s%s' % (
+                callback, '&' if '?' in callback else '?',
+                urllib.urlencode({'oauth_token': params['oauth_token'],
+                                  'oauth_verifier': verifier})))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if endpoint == 'access_token':
+            with server._lock:
+                request = server._request_tokens.pop(
+                    oauth.get('oauth_token'), None)
+            if request is None or request.get('verifier') is None or \
+                    request['verifier'] != oauth.get('oauth_verifier'):
+                return self._send(401, 'Invalid request token')
+            user_id = request['user_id']
+            key = 'access-%s-%s' % (user_id, random.getrandbits(64))
+            server.add_user(user_id, server.users[user_id], key)
+            return self._send(200, urllib.urlencode({
+                'oauth_token': key,
+                'oauth_token_secret': 'secret-%s' % key,
+                'user_id': user_id,
+                'screen_name': server.users[user_id]}))
+        self._send(404, 'Unknown OAuth endpoint')
+
+
+def _int(value):
+    return int(value) if value else None
+
+
+def mentions_timeline(server, user_id, params, body):
+    return 200, server.mentions(user_id, _int(params.get('since_id')),
+                                _int(params.get('max_id')),
+                                min(_int(params.get('count')) or 20, 200))
+
+
+def update_status(server, user_id, params, body):
+    media = 0
+    text = params.get('status', '').decode('utf-8')
+    if not text:
+        return 403, _error(170, 'Missing required parameter: status')
+    for media_id in filter(None, params.get('media_ids', '').split(',')):
+        owner, size, expires = server.media.get(int(media_id), (0, 0, 0))
+        if owner != user_id or expires <= time.time():
+            return 400, _error(324, 'The validation of media ids failed.')
+        media += size
+    status = server.tweet(user_id, text)
+    with server._lock:
+        server.posted.append((time.time(), user_id, text, media))
+    return 200, status
+
+
+def upload_media(server, user_id, params, body):
+    with server._lock:
+        media_id = len(server.media) + 1
+        server.media[media_id] = (user_id, len(body),
+                                  time.time() + server.media_ttl)
+        server.stats['uploads'] += 1
+        server.stats['uploaded_bytes'] += len(body)
+    return 200, {'media_id': media_id, 'media_id_string': str(media_id),
+                 'size': len(body), 'expires_after_secs': server.media_ttl}
+
+
+def get_user(server, user_id, params, body):
+    user = server.user(_int(params.get('user_id') or params.get('id')),
+                       params.get('screen_name'))
+    if user is None:
+        return 404, _error(50, 'User not found.')
+    return 200, user
+
+
+def verify_credentials(server, user_id, params, body):
+    return 200, server.user(user_id)
+
+
+ROUTES = {
+    ('GET', '/statuses/mentions_timeline.json'): mentions_timeline,
+    ('POST', '/statuses/update.json'): update_status,
+    ('POST', '/media/upload.json'): upload_media,
+    ('GET', '/users/show.json'): get_user,
+    ('GET', '/account/verify_credentials.json'): verify_credentials,
+}
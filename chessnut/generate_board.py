@@ -1,40 +1,191 @@
 #!usr/bin/env Python
 
-from os.path import isfile
+from io import BytesIO
 from PIL import Image
+from . import render_cache
 
 start = 'rnbqkbnrpppppppp00000000000000000000000000000000PPPPPPPPRNBQKBNR'
 
+pieces = {'b': 'bishop', 'k': 'king', 'n': 'knight', 'q': 'queen',
+          'p': 'pawn', 'r': 'rook'}
 
-def board(state=start):
-    if isfile('chessnut/static/boards/%s.png' % state):
-        return Image.open('chessnut/static/boards/%s.png' % state)
-    BOARD = Image.open('chessnut/static/elements/board.png').copy()
-    pieces = {'b': 'bishop', 'k': 'king', 'n': 'knight', 'q': 'queen',
-              'p': 'pawn', 'r': 'rook'}
-    glow = Image.open('chessnut/static/elements/glow.png')
+#'pil' pastes sprites one at a time; 'numpy' composites them as arrays
+backend = 'pil'
+
+
+def configure(settings):
+    """Picks the renderer for full boards from render.backend."""
+    global backend
+    backend = settings.get('render.backend', '').strip() or 'pil'
+    if backend not in ('pil', 'numpy'):
+        raise ValueError("Unknown render backend: %s" % backend)
+
+
+def offset(c, r):
+    """Returns the pixel offset of the square at column c, row r."""
+    return (26 + (58 * c), 11 + (58 * r))
+
+
+def glows(state):
+    """Returns the set of (column, row) squares highlighted by the move
+    recorded at the end of an image string.
+    """
     if len(state) == 67:  # CASTLING GLOWS
         r = 0 if state[64] == "B" else 7
         columns = [4, 5, 6, 7] if state[65] == "K" else [0, 2, 3, 4]
-        for c in columns:  # NORMAL GLOWS
-            BOARD.paste(glow, (26 + (58 * c), 11 + (58 * r)), glow)
-    if len(state) == 68:
-        BOARD.paste(glow, (26 + (58 * int(state[64])),
-                           11 + (58 * int(state[65]))), glow)
-        BOARD.paste(glow, (26 + (58 * int(state[66])),
-                           11 + (58 * int(state[67]))), glow)
+        return set((c, r) for c in columns)
+    if len(state) == 68:  # NORMAL GLOWS
+        return set([(int(state[64]), int(state[65])),
+                    (int(state[66]), int(state[67]))])
+    return set()
+
+
+def changed_squares(previous, state):
+    """Returns the (column, row) squares that differ between two image
+    strings, including squares whose glow was added or removed.
+    """
+    squares = glows(previous) | glows(state)
+    for index in xrange(64):
+        if previous[index] != state[index]:
+            squares.add((index % 8, index // 8))
+    return squares
+
+
+_elements = {}
+
+
+def element(name):
+    """Returns the named image from static/elements, loading each file
+    only once per process.
+    """
+    if name not in _elements:
+        image = Image.open('chessnut/static/elements/%s.png' % name)
+        image.load()
+        _elements[name] = image
+    return _elements[name]
+
+
+def _paint_piece(BOARD, i, c, r):
+    p = element(pieces[i.lower()])
+    if i in 'rnbqkp':
+        BOARD.paste(p, offset(c, r), p)
+    else:
+        BOARD.paste((91, 94, 243), offset(c, r), p)
+
+
+def _full(state):
+    if backend == 'numpy':
+        from . import array_board
+        return array_board.render(state)
+    return _pil(state)
+
+
+def _pil(state):
+    BOARD = element('board').copy()
+    glow = element('glow')
+    for c, r in glows(state):
+        BOARD.paste(glow, offset(c, r), glow)
     for index, i in enumerate(state[:64]):  # PLACING PIECES ON BOARD
         if i != '0':
-            c = index % 8 if i != 0 else 0
-            r = (index - c) // 8 if i != 0 else 0
-            p = Image.open('chessnut/static/elements/%s.png' %
-                           pieces[i.lower()])
-            if i in 'rnbqkp':
-                BOARD.paste(p, (26 + (58 * c), 11 + (58 * r)), p)
-            else:
-                BOARD.paste((91, 94, 243), (26 + (58 * c), 11 + (58 * r)), p)
-    BOARD.save('chessnut/static/boards/%s.png' % state)
+            _paint_piece(BOARD, i, index % 8, index // 8)
+    return BOARD
+
+
+def _incremental(frame, previous, state):
+    """Repaints only the squares that changed since the previous frame."""
+    BOARD = frame.copy()
+    base = element('board')
+    glow = element('glow')
+    lit = glows(state)
+    for c, r in changed_squares(previous, state):
+        x, y = offset(c, r)
+        BOARD.paste(base.crop((x, y, x + 58, y + 58)), (x, y))
+        if (c, r) in lit:
+            BOARD.paste(glow, (x, y), glow)
+        i = state[(r * 8) + c]
+        if i != '0':
+            _paint_piece(BOARD, i, c, r)
     return BOARD
 
+
+def board(state=start, previous=None, frame=None, buffer=False):
+    """Renders the image string state and stores it in the board cache.
+
+    If previous (the image string of the prior position) is given, the
+    board is repainted from that frame -- passed in as frame, or read from
+    the cache if its format is lossless enough -- touching only the
+    squares the move changed. Without a previous frame the whole board is
+    rendered. With buffer set, returns the encoded board in a BytesIO
+    instead of the image.
+    """
+    cache = render_cache.cache
+    if buffer:
+        data = cache.encoded(state)
+        if data is not None:
+            return BytesIO(data)
+    else:
+        BOARD = cache.get(state)
+        if BOARD is not None:
+            return BOARD
+    BOARD, data = _render(state, previous, frame)
+    return BytesIO(data) if buffer else BOARD
+
+
+def _render(state, previous=None, frame=None):
+    """Renders state, from frame if there is one, into the board cache and
+    returns the board with its encoded bytes.
+    """
+    cache = render_cache.cache
+    if frame is None and previous is not None and cache.reusable_frames:
+        frame = cache.get(previous)
+    if frame is not None and previous is not None:
+        BOARD = _incremental(frame, previous, state)
+    else:
+        BOARD = _full(state)
+    return BOARD, cache.put(state, BOARD)
+
+
+def board_many(states, buffer=False, parallel=False):
+    """Renders a batch of image strings, yielding (state, board) pairs as
+    they are ready so memory stays flat however long the batch is.
+
+    Repeated states are rendered and yielded once and cached boards are
+    not re-rendered. In order, each board is repainted from the one before
+    it, which suits consecutive positions of a game. With parallel set,
+    states are rendered out of order on the shared render pool instead.
+    """
+    cache = render_cache.cache
+    seen = set()
+
+    def unique():
+        for state in states:
+            if state not in seen:
+                seen.add(state)
+                yield state
+
+    if parallel:
+        from . import render_pool
+        results = render_pool.get_pool().imap_unordered(
+            render_pool.render_pair, unique())
+        for state, data in results:
+            f = BytesIO(data)
+            yield state, f if buffer else Image.open(f)
+        return
+    previous = frame = None
+    for state in unique():
+        image = cache.get(state)
+        if image is not None:
+            data = cache.encoded(state) if buffer else None
+            #a board decoded from a lossy format would pass its losses on
+            frame = image if cache.reusable_frames else None
+        else:
+            image, data = _render(state, previous, frame)
+            frame = image
+        if buffer and data is None:
+            #dropped from the cache since it was read
+            data = cache.put(state, image)
+        previous = state
+        yield state, BytesIO(data) if buffer else image
+
 if __name__ == '__main__':
     board().show()
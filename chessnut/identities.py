@@ -0,0 +1,109 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from .models import TwUser
+
+
+class IdentityCache(object):
+    """Maps Twitter user ids to screen names and back.
+
+    Entries are learned from the user and user_mentions of incoming tweets
+    and are good for ttl seconds. Registered users' screen names are also
+    kept on their TwUser row, which is consulted once an entry has expired
+    from memory. get_user is only called when neither knows the answer.
+    """
+
+    def __init__(self, ttl=86400):
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'lookups': 0}
+        self._lock = threading.Lock()
+        self._names = {}
+        self._ids = {}
+
+    def remember(self, user_id, screen_name, twuser=None, now=None):
+        """Records that user_id is screen_name, on twuser too if given."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._names[user_id] = (screen_name, now + self.ttl)
+            self._ids[screen_name.lower()] = (user_id, now + self.ttl)
+        if twuser is not None and (twuser.screen_name != screen_name or
+                                   not self._stored(twuser, now)):
+            twuser.screen_name = screen_name
+            twuser.screen_name_checked = datetime.utcfromtimestamp(now)
+
+    def observe(self, tweet, twuser=None):
+        """Learns the author and everyone mentioned in tweet. twuser is
+        the author's TwUser, if they're registered.
+        """
+        self.remember(tweet.user.id, tweet.user.screen_name, twuser)
+        entities = getattr(tweet, 'entities', None) or {}
+        for mention in entities.get('user_mentions', []):
+            self.remember(mention['id'], mention['screen_name'])
+
+    def _fresh(self, table, key, now):
+        with self._lock:
+            entry = table.get(key)
+        if entry is not None and entry[1] > now:
+            self.stats['hits'] += 1
+            return entry[0]
+        return None
+
+    def _stored(self, twuser, now):
+        if twuser is None or twuser.screen_name is None or \
+                twuser.screen_name_checked is None:
+            return False
+        age = datetime.utcfromtimestamp(now) - twuser.screen_name_checked
+        return age < timedelta(seconds=self.ttl)
+
+    def screen_name(self, user_id, api, now=None):
+        """Returns the screen name of user_id, asking api as a last
+        resort.
+        """
+        if now is None:
+            now = time.time()
+        screen_name = self._fresh(self._names, user_id, now)
+        if screen_name is not None:
+            return screen_name
+        twuser = TwUser.get_by_user_id(user_id)
+        if self._stored(twuser, now):
+            self.stats['hits'] += 1
+            self.remember(user_id, twuser.screen_name, now=now)
+            return twuser.screen_name
+        self.stats['lookups'] += 1
+        screen_name = api.get_user(user_id).screen_name
+        self.remember(user_id, screen_name, twuser, now)
+        return screen_name
+
+    def user_id(self, screen_name, api, now=None):
+        """Returns the user id of screen_name, asking api as a last
+        resort.
+        """
+        if now is None:
+            now = time.time()
+        user_id = self._fresh(self._ids, screen_name.lower(), now)
+        if user_id is not None:
+            return user_id
+        twuser = TwUser.get_by_screen_name(screen_name)
+        if self._stored(twuser, now):
+            self.stats['hits'] += 1
+            self.remember(twuser.user_id, twuser.screen_name, now=now)
+            return twuser.user_id
+        self.stats['lookups'] += 1
+        user = api.get_user(screen_name)
+        self.remember(user.id, user.screen_name,
+                      TwUser.get_by_user_id(user.id), now)
+        return user.id
+
+
+cache = IdentityCache()
+
+
+def configure(settings):
+    """Replaces the shared identity cache with one whose ttl is
+    twitter.identity_ttl seconds.
+    """
+    global cache
+    cache = IdentityCache(int(settings.get('twitter.identity_ttl') or 86400))
+    return cache
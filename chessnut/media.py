@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class MediaCache(object):
+    """Remembers the media id each board was uploaded as, so a board
+    posted again is attached by id instead of being uploaded again.
+
+    Uploaded media can only be attached by the account that uploaded it,
+    and only for as long as Twitter keeps it, so entries are per account
+    and are good for ttl seconds. At most max_entries are kept, the least
+    recently used going first.
+    """
+
+    def __init__(self, ttl=86400, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0}
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, account, state, now=None):
+        """Returns the media id account uploaded the board for image string
+        state as, or None.
+        """
+        if now is None:
+            now = time.time()
+        key = (account, state)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[1] <= now:
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries[key] = entry
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def put(self, account, state, media_id, now=None):
+        """Records that account uploaded the board for state as media_id."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._entries.pop((account, state), None)
+            self._entries[(account, state)] = (media_id, now + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, account, state):
+        with self._lock:
+            self._entries.pop((account, state), None)
+
+
+cache = MediaCache()
+
+
+def configure(settings):
+    """Replaces the shared media cache with one built from the media.*
+    keys.
+    """
+    global cache
+    cache = MediaCache(int(settings.get('media.ttl') or 86400),
+                       int(settings.get('media.max_entries') or 10000))
+    return cache
@@ -0,0 +1,135 @@
+import httplib
+import json
+import logging
+import threading
+import urllib
+
+from tweepy.models import Status
+
+
+log = logging.getLogger(__name__)
+
+
+class MentionStream(object):
+    """Long-lived connection to the user stream that hands every tweet
+    mentioning user_id to on_tweet as a tweepy Status.
+
+    Dropped connections are reopened after retry_time seconds, doubling on
+    each failure up to retry_cap and reset once a connection succeeds.
+    host, port and secure let it point at a local stand-in server.
+    """
+
+    def __init__(self, auth, user_id, on_tweet, host='userstream.twitter.com',
+                 port=None, secure=True, path='/1.1/user.json',
+                 timeout=90.0, retry_time=5.0, retry_cap=320.0):
+        self.auth = auth
+        self.user_id = user_id
+        self.on_tweet = on_tweet
+        self.host = host
+        self.port = port
+        self.secure = secure
+        self.path = path
+        self.timeout = timeout
+        self.retry_time = retry_time
+        self.retry_cap = retry_cap
+        self.running = False
+        self.connections = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        self._stopped.set()
+
+    def _wait(self, seconds):
+        self._stopped.wait(seconds)
+
+    def run(self):
+        retry = self.retry_time
+        while self.running:
+            try:
+                if self._connect():
+                    retry = self.retry_time
+            except Exception:
+                #whatever broke the connection, the thread keeps retrying
+                log.warning("mention stream dropped", exc_info=True)
+            if self.running:
+                self._wait(retry)
+                retry = min(retry * 2, self.retry_cap)
+
+    def _connect(self):
+        """Reads one connection until it closes. Returns whether the
+        server accepted it.
+        """
+        host = self.host if self.port is None else \
+            '%s:%s' % (self.host, self.port)
+        url = '%s://%s%s' % ('https' if self.secure else 'http', host,
+                             self.path)
+        parameters = {'delimited': 'length', 'with': 'user'}
+        headers = {}
+        if self.auth is not None:
+            self.auth.apply_auth(url, 'GET', headers, parameters)
+        connection = (httplib.HTTPSConnection if self.secure
+                      else httplib.HTTPConnection)
+        conn = connection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request('GET', '%s?%s' % (self.path, urllib.urlencode(
+                sorted(parameters.items()))), headers=headers)
+            resp = conn.getresponse()
+            if resp.status != 200:
+                log.warning("mention stream refused: %s", resp.status)
+                return False
+            self.connections += 1
+            self._read(resp)
+            return True
+        finally:
+            conn.close()
+
+    def _read(self, resp):
+        #reads through resp, not resp.fp, so chunked bodies are decoded
+        while self.running:
+            line = self._readline(resp)
+            if not line:
+                return
+            line = line.strip()
+            #blank lines are keep-alives
+            if not line.isdigit():
+                continue
+            raw = resp.read(int(line))
+            try:
+                self._data(raw)
+            except (ValueError, AttributeError, KeyError, TypeError):
+                log.warning("couldn't parse streamed message: %r", raw[:200],
+                            exc_info=True)
+
+    def _readline(self, resp):
+        chars = []
+        while True:
+            char = resp.read(1)
+            if not char:
+                break
+            chars.append(char)
+            if char == '\n':
+                break
+        return ''.join(chars)
+
+    def _data(self, raw):
+        data = json.loads(raw)
+        if 'text' not in data or 'user' not in data:
+            return
+        mentioned = [m['id'] for m in
+                     data.get('entities', {}).get('user_mentions', [])]
+        if self.user_id not in mentioned or \
+                data['user']['id'] == self.user_id:
+            return
+        try:
+            self.on_tweet(Status.parse(None, data))
+        except Exception:
+            log.exception("couldn't process streamed tweet %s", data['id'])
@@ -5,8 +5,12 @@ from sqlalchemy import (
     UnicodeText,
     ForeignKey,
     BigInteger,
+    DateTime,
+    func,
     )
 
+from datetime import datetime
+
 from sqlalchemy.ext.declarative import declarative_base
 
 from pyramid.security import (
@@ -32,11 +36,15 @@ class TwUser(Base):
     key = Column(Unicode(80))
     secret = Column(Unicode(80))
     user_id = Column(BigInteger)
+    screen_name = Column(Unicode(50), nullable=True)
+    #when screen_name was last seen on a tweet or looked up
+    screen_name_checked = Column(DateTime, nullable=True)
 
-    def __init__(self, key, secret, user_id):
+    def __init__(self, key, secret, user_id, screen_name=None):
         self.key = key
         self.secret = secret
         self.user_id = user_id
+        self.screen_name = screen_name
 
     @classmethod
     def get_by_id(cls, id):
@@ -50,6 +58,11 @@ class TwUser(Base):
     def get_by_user_id(cls, user_id):
         return DBSession.query(cls).filter(cls.user_id == user_id).first()
 
+    @classmethod
+    def get_by_screen_name(cls, screen_name):
+        return DBSession.query(cls).filter(
+            func.lower(cls.screen_name) == screen_name.lower()).first()
+
 
 class Challenge(Base):
     __tablename__ = 'challenge'
@@ -135,3 +148,75 @@ class SinceId(Base):
     @classmethod
     def get_by_id(cls, id):
         return DBSession.query(cls).filter(cls.id == id).first()
+
+
+class OutboundTweet(Base):
+    """A reply waiting to be posted by the outbox (see outbox.Outbox)."""
+    __tablename__ = 'outbound_tweet'
+    id = Column(Integer, primary_key=True)
+    #TwUser id of the account that posts it
+    account = Column(Integer, ForeignKey('twuser.id'), nullable=False)
+    status = Column(UnicodeText, nullable=False)
+    #image strings of the board to attach and of the position before it
+    board = Column(Unicode(80), nullable=True)
+    previous = Column(Unicode(80), nullable=True)
+    #id of the mention it answers, to time the reply (see timing)
+    mention_id = Column(BigInteger, nullable=True)
+    #pending until posted, dead once it has failed too often
+    state = Column(Unicode(10), nullable=False, default=u'pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt = Column(DateTime, nullable=False)
+    last_error = Column(UnicodeText, nullable=True)
+
+    def __init__(self, account, status, board=None, previous=None,
+                 next_attempt=None, mention_id=None):
+        self.account = account
+        self.status = status
+        self.board = board
+        self.previous = previous
+        self.mention_id = mention_id
+        self.state = u'pending'
+        self.attempts = 0
+        self.next_attempt = next_attempt or datetime.utcnow()
+
+    @classmethod
+    def pending(cls, limit=None):
+        query = DBSession.query(cls).filter(
+            cls.state == u'pending').order_by(cls.id)
+        return query.limit(limit).all() if limit else query.all()
+
+    @classmethod
+    def dead(cls):
+        return DBSession.query(cls).filter(cls.state == u'dead').all()
+
+
+class ProcessedTweet(Base):
+    """Journal of the mentions already played, written in the same
+    transaction as whatever they changed.
+    """
+    __tablename__ = 'processed_tweet'
+    tweet_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    processed = Column(DateTime, nullable=False)
+
+    def __init__(self, tweet_id):
+        self.tweet_id = tweet_id
+        self.processed = datetime.utcnow()
+
+    @classmethod
+    def seen(cls, tweet_id):
+        return DBSession.query(cls.tweet_id).filter(
+            cls.tweet_id == tweet_id).first() is not None
+
+    @classmethod
+    def processed_ids(cls, tweet_ids):
+        """Returns the set of tweet_ids already in the journal."""
+        if not tweet_ids:
+            return set()
+        query = DBSession.query(cls.tweet_id).filter(
+            cls.tweet_id.in_(list(tweet_ids)))
+        return set(row.tweet_id for row in query)
+
+    @classmethod
+    def prune(cls, up_to):
+        """Forgets tweets up to id up_to, which polling won't see again."""
+        return DBSession.query(cls).filter(cls.tweet_id <= up_to).delete()
@@ -0,0 +1,157 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+import transaction
+
+from . import timing
+from .models import DBSession, OutboundTweet
+
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Allows rate posts a second on average, in bursts of up to burst."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = None
+
+    def take(self, now=None):
+        """Spends a token if there is one. Returns whether it could."""
+        if now is None:
+            now = time.time()
+        if self.updated is not None:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Outbox(object):
+    """Durable queue of outbound tweets, kept in the outbound_tweet table.
+
+    Tweets are queued in the same transaction as the game state they
+    report, and posted later by drain. Each account posts through its own
+    token bucket. A failed post is retried after backoff seconds, doubling
+    each time up to backoff_cap, and is marked dead after max_attempts.
+    """
+
+    def __init__(self, rate_per_hour=100, burst=10, max_attempts=5,
+                 backoff=30, backoff_cap=3600):
+        self.rate = rate_per_hour / 3600.0
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.stats = {'queued': 0, 'sent': 0, 'failed': 0, 'dead': 0,
+                      'throttled': 0}
+        self._buckets = {}
+
+    def enqueue(self, account, status, board=None, previous=None,
+                mention_id=None):
+        """Queues status to be posted by TwUser id account, with the board
+        for image string board attached if given, in answer to the mention
+        mention_id.
+        """
+        tweet = OutboundTweet(account, status, board, previous,
+                              mention_id=mention_id)
+        DBSession.add(tweet)
+        self.stats['queued'] += 1
+        timing.timings.mark(mention_id, 'queued')
+        return tweet
+
+    def _bucket(self, account):
+        if account not in self._buckets:
+            self._buckets[account] = TokenBucket(self.rate, self.burst)
+        return self._buckets[account]
+
+    def _retry_delay(self, attempts):
+        return min(self.backoff * 2 ** (attempts - 1), self.backoff_cap)
+
+    def drain(self, post, now=None, limit=None):
+        """Posts the tweets that are due, oldest first, each with
+        post(tweet) in a transaction of its own. Once an account is out of
+        tokens, or has a tweet that failed or is backing off, the rest of
+        its tweets wait so they go out in order. Returns how many were
+        sent.
+        """
+        if now is None:
+            now = time.time()
+        with transaction.manager:
+            pending = [(t.id, t.account, t.next_attempt)
+                       for t in OutboundTweet.pending(limit)]
+        blocked = set()
+        sent = 0
+        for id, account, next_attempt in pending:
+            if next_attempt > datetime.utcfromtimestamp(now):
+                #a tweet backing off holds up the account's later ones
+                blocked.add(account)
+            if account in blocked:
+                continue
+            with transaction.manager:
+                tweet = DBSession.query(OutboundTweet).get(id)
+                if tweet is None or tweet.state != u'pending':
+                    continue
+                if not self._bucket(tweet.account).take(now):
+                    self.stats['throttled'] += 1
+                    blocked.add(tweet.account)
+                    continue
+                try:
+                    post(tweet)
+                except Exception as e:
+                    blocked.add(tweet.account)
+                    self._failed(tweet, e, now)
+                    continue
+                DBSession.delete(tweet)
+                self.stats['sent'] += 1
+                sent += 1
+        return sent
+
+    def _failed(self, tweet, error, now):
+        tweet.attempts += 1
+        tweet.last_error = unicode(error)
+        self.stats['failed'] += 1
+        if tweet.attempts >= self.max_attempts:
+            tweet.state = u'dead'
+            self.stats['dead'] += 1
+            log.error("gave up posting tweet %s: %s", tweet.id, error)
+            return
+        tweet.next_attempt = datetime.utcfromtimestamp(now) + timedelta(
+            seconds=self._retry_delay(tweet.attempts))
+        log.warning("couldn't post tweet %s, attempt %s: %s",
+                    tweet.id, tweet.attempts, error)
+
+    def retry_dead(self):
+        """Puts every dead tweet back in the queue."""
+        for tweet in OutboundTweet.dead():
+            tweet.state = u'pending'
+            tweet.attempts = 0
+            tweet.next_attempt = datetime.utcnow()
+
+
+def _setting(settings, key, default):
+    value = settings.get('outbox.%s' % key)
+    return int(value) if value and value.strip() else default
+
+
+queue = Outbox()
+
+
+def configure(settings):
+    """Replaces the shared outbox with one built from the outbox.* keys."""
+    global queue
+    queue = Outbox(
+        rate_per_hour=_setting(settings, 'rate_per_hour', 100),
+        burst=_setting(settings, 'burst', 10),
+        max_attempts=_setting(settings, 'max_attempts', 5),
+        backoff=_setting(settings, 'backoff', 30),
+        backoff_cap=_setting(settings, 'backoff_cap', 3600),
+    )
+    return queue
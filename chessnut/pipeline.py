@@ -0,0 +1,227 @@
+"""Staged processing of incoming mentions.
+
+    parse -> play -> render
+
+The mentions poll and the mention stream fetch tweets and put them into the
+pipeline. Every stage has a bounded input queue, so one that falls behind
+blocks the stage feeding it, and its own worker threads. Loading, validating
+and saving a move are the one play stage, because they share the game's
+transaction; that transaction also queues the reply in the outbox, which
+views.send_tweets posts. Rendering is CPU bound and runs on the render_pool
+processes, whose boards are put into this process's board cache so the
+reply is posted without rendering.
+
+Whoever puts tweets in can wait for just those to be played with a Waiter.
+"""
+import logging
+import threading
+import time
+from Queue import Empty, Queue
+
+from . import dispatch, render_cache, render_pool, timing
+from .twitter import parse, send_errors
+
+
+log = logging.getLogger(__name__)
+
+
+class Stage(object):
+    """A step of the pipeline. Each of its worker threads takes an item
+    from a queue of up to maxsize and passes the list work returns for it
+    on to the next stage. A batch stage's work is given every item waiting
+    instead.
+    """
+
+    def __init__(self, name, work, workers=1, maxsize=100, batch=False):
+        self.name = name
+        self.work = work
+        self.workers = workers
+        self.batch = batch
+        self.queue = Queue(maxsize)
+        self.next = None
+        self.stats = {'in': 0, 'out': 0, 'errors': 0, 'busy_seconds': 0.0}
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i in xrange(self.workers):
+            worker = threading.Thread(target=self._loop,
+                                      name='%s-%s' % (self.name, i))
+            worker.daemon = True
+            worker.start()
+
+    def _take(self):
+        items = [self.queue.get()]
+        while self.batch and len(items) < self.queue.maxsize:
+            try:
+                items.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._take()
+            began = time.time()
+            try:
+                out = self.work(items if self.batch else items[0]) or []
+            except Exception:
+                log.exception("pipeline stage %s failed", self.name)
+                out, errors = [], 1
+            else:
+                errors = 0
+            with self._lock:
+                self.stats['in'] += len(items)
+                self.stats['out'] += len(out)
+                self.stats['errors'] += errors
+                self.stats['busy_seconds'] += time.time() - began
+            #passed on before they're marked done, so joining each stage in
+            #turn waits for everything upstream of the next
+            if self.next is not None:
+                for item in out:
+                    self.next.queue.put(item)
+            for item in items:
+                self.queue.task_done()
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats)
+        busy = stats['busy_seconds']
+        return dict(stats, stage=self.name, workers=self.workers,
+                    depth=self.queue.qsize(),
+                    per_second=stats['in'] / busy if busy else None)
+
+
+class Waiter(object):
+    """Lets whoever puts tweets into the pipeline wait for those tweets to
+    be played, rather than for everything in it to get through every
+    stage. The play stage settles each tweet it's given that carries one,
+    with why it wasn't played if it wasn't (see dispatch.process).
+    """
+
+    def __init__(self, tweets):
+        self._lock = threading.Lock()
+        self._left = set()
+        self._unplayed = {}
+        self._done = threading.Event()
+        for tweet in tweets:
+            tweet.waiter = self
+            self._left.add(tweet.id)
+        if not self._left:
+            self._done.set()
+
+    def settle(self, tweet_id, unplayed=None):
+        with self._lock:
+            self._left.discard(tweet_id)
+            if unplayed is not None:
+                self._unplayed[tweet_id] = unplayed
+            if not self._left:
+                self._done.set()
+
+    def unplayed(self):
+        """Returns the ids of the tweets still in the pipeline."""
+        with self._lock:
+            return set(self._left)
+
+    def take_unplayed(self):
+        """Returns {tweet id: why} of the tweets settled without being
+        played since last asked.
+        """
+        with self._lock:
+            unplayed, self._unplayed = self._unplayed, {}
+            return unplayed
+
+    def wait(self, timeout=None):
+        """Blocks until every tweet has been settled or timeout seconds
+        have passed. Returns the ids of any that haven't been played.
+        """
+        self._done.wait(timeout)
+        with self._lock:
+            return self._left | set(self._unplayed)
+
+
+class Pipeline(object):
+    """Stages chained in order, started on the first put."""
+
+    def __init__(self, stages):
+        self.stages = stages
+        for stage, following in zip(stages, stages[1:]):
+            stage.next = following
+        self._started = False
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        """Feeds item to the first stage, blocking while it's full."""
+        with self._lock:
+            if not self._started:
+                for stage in self.stages:
+                    stage.start()
+                self._started = True
+        self.stages[0].queue.put(item)
+
+    def join(self):
+        """Blocks until everything put so far has been through every
+        stage.
+        """
+        for stage in self.stages:
+            stage.queue.join()
+
+    def metrics(self):
+        return [stage.metrics() for stage in self.stages]
+
+
+def _parse(tweet):
+    parse(tweet)
+    return [tweet]
+
+
+def _play(tweets):
+    try:
+        boards = dispatch.dispatcher.dispatch(tweets)
+    except Exception:
+        for tweet in tweets:
+            tweet.unplayed = 'failed'
+        raise
+    finally:
+        for tweet in tweets:
+            waiter = getattr(tweet, 'waiter', None)
+            if waiter is not None:
+                waiter.settle(tweet.id, getattr(tweet, 'unplayed', None))
+    #a reply per user for all the errors the batch earned them
+    send_errors()
+    return boards
+
+
+def _render(board):
+    state, previous, mention_id = board
+    cache = render_cache.cache
+    if cache.encoded(state) is None:
+        data = render_pool.get_pool().apply(render_pool.render,
+                                            (state, previous))
+        #a worker that writes boards to disk has cached it already
+        if cache.encoded(state) is None:
+            cache.put_encoded(state, data)
+    timing.timings.mark(mention_id, 'rendered')
+
+
+def build(queue_size=100, render_workers=2):
+    """Returns the mention pipeline. parse keeps to one worker so tweets
+    reach play in the order they came in; play runs a batch at a time,
+    each game in it concurrently on the dispatcher's workers.
+    """
+    return Pipeline([
+        Stage('parse', _parse, 1, queue_size),
+        Stage('play', _play, 1, queue_size, batch=True),
+        Stage('render', _render, render_workers, queue_size),
+    ])
+
+
+mentions = build()
+
+
+def configure(settings):
+    """Replaces the shared pipeline with one built from pipeline.* keys."""
+    global mentions
+    mentions = build(
+        int(settings.get('pipeline.queue_size') or 100),
+        int(settings.get('pipeline.render_workers') or 2))
+    return mentions
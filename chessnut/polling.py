@@ -0,0 +1,80 @@
+import time
+
+
+class PollSchedule(object):
+    """Works out how long to wait before the next mentions poll.
+
+    The interval halves, down to min_seconds, each time a poll finds
+    mentions and doubles, up to max_seconds, each time one comes back
+    empty. A poll that is behind, having run out of pages before reading
+    back to the last mention seen, is followed after min_seconds. It is
+    never shorter than the time it takes to spread the calls
+    left in the current rate limit window evenly over what remains of it.
+    """
+
+    def __init__(self, min_seconds=15, max_seconds=300, interval=None):
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.interval = interval or min_seconds
+        self.remaining = None
+        self.limit = None
+        self.reset = None
+        self.stats = {'polls': 0, 'busy_polls': 0, 'throttled_polls': 0}
+
+    def update(self, found, remaining=None, limit=None, reset=None,
+               now=None, behind=False):
+        """Records a poll that found found mentions, along with the rate
+        limit it reported, and returns the seconds to wait until the next.
+        reset is the epoch second the rate limit window ends. behind says
+        the poll left mentions to be read by the next.
+        """
+        if now is None:
+            now = time.time()
+        self.stats['polls'] += 1
+        if behind:
+            self.stats['busy_polls'] += 1
+            interval = self.min_seconds
+        elif found:
+            self.stats['busy_polls'] += 1
+            interval = max(self.min_seconds, self.interval / 2.0)
+        else:
+            interval = min(self.max_seconds, self.interval * 2.0)
+        self.remaining, self.limit, self.reset = remaining, limit, reset
+        if remaining is not None and reset is not None:
+            window = max(reset - now, 0)
+            #with nothing left, wait out the window
+            floor = window + 1 if remaining <= 0 else window / remaining
+            if floor > interval:
+                self.stats['throttled_polls'] += 1
+                interval = floor
+        self.interval = interval
+        return interval
+
+    def metrics(self, now=None):
+        """Returns the current interval and rate limit headroom."""
+        if now is None:
+            now = time.time()
+        headroom = None
+        if self.remaining is not None and self.limit:
+            headroom = float(self.remaining) / self.limit
+        return dict(self.stats,
+                    interval=self.interval,
+                    remaining=self.remaining,
+                    limit=self.limit,
+                    headroom=headroom,
+                    reset_in=(max(self.reset - now, 0)
+                              if self.reset is not None else None))
+
+
+def rate_limit(api):
+    """Returns the (remaining, limit, reset) rate limit headers of api's
+    last response, each None if it didn't send them. With twitter.API
+    that's the response to the calling thread's last call.
+    """
+    resp = getattr(api, 'last_response', None)
+    values = []
+    for header in ('remaining', 'limit', 'reset'):
+        value = resp.getheader('x-rate-limit-%s' % header) \
+            if resp is not None else None
+        values.append(int(value) if value else None)
+    return tuple(values)
@@ -0,0 +1,89 @@
+from .models import (
+    DBSession,
+    TwUser,
+    Game,
+    Challenge,
+    )
+
+
+class Batch(object):
+    """Identity map of the users, games and challenges a batch of mentions
+    refers to, loaded with one IN query per table.
+
+    Lookups of anything the batch didn't load fall through to the usual
+    queries and are kept, so rows created while the batch is played are
+    still found. Its rows stay usable across transactions only in a
+    session that doesn't expire them on commit, and each commit closes
+    the session, so they have to be attached again before they're changed;
+    see dispatch.process.
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.users_by_user_id = {}
+        self.games = {}
+        self.challenges = {}
+        self.stats = {'hits': 0, 'queries': 0}
+
+    @classmethod
+    def load(cls, tweets, parse):
+        """Returns the Batch for tweets, parsing each with parse."""
+        batch = cls()
+        user_ids = set(t.user.id for t in tweets)
+        names = set(p['game'] for p in map(parse, tweets) if p is not None)
+        if user_ids:
+            batch._add_users(DBSession.query(TwUser).filter(
+                TwUser.user_id.in_(list(user_ids))))
+        if names:
+            batch.stats['queries'] += 2
+            for game in DBSession.query(Game).filter(
+                    Game.name.in_(list(names))):
+                batch.games[game.name] = game
+            for challenge in DBSession.query(Challenge).filter(
+                    Challenge.name.in_(list(names))):
+                batch.challenges[challenge.name] = challenge
+        players = set()
+        for game in batch.games.values():
+            players.update((game.owner, game.opponent))
+        players.difference_update(batch.users)
+        if players:
+            batch._add_users(DBSession.query(TwUser).filter(
+                TwUser.id.in_(list(players))))
+        return batch
+
+    def attach(self):
+        """Adds the batch's rows to the current session, so changes to
+        them are saved when its transaction commits.
+        """
+        rows = set(self.users.values())
+        rows.update(self.games.values(), self.challenges.values())
+        DBSession.add_all(rows)
+
+    def _add_users(self, query):
+        self.stats['queries'] += 1
+        for user in query:
+            self.users[user.id] = user
+            self.users_by_user_id[user.user_id] = user
+
+    def _get(self, table, key, fetch):
+        if key in table:
+            self.stats['hits'] += 1
+            return table[key]
+        self.stats['queries'] += 1
+        value = fetch(key)
+        if value is not None:
+            table[key] = value
+        return value
+
+    def user(self, id):
+        return self._get(self.users, id, TwUser.get_by_id)
+
+    def user_by_user_id(self, user_id):
+        return self._get(self.users_by_user_id, user_id,
+                         TwUser.get_by_user_id)
+
+    def game(self, name):
+        return self._get(self.games, name, Game.get_by_name)
+
+    def challenge(self, name):
+        return self._get(self.challenges, name, Challenge.get_by_name)
@@ -0,0 +1,96 @@
+"""Golden-image corpus and benchmark for the board renderers.
+
+    python -m chessnut.render_bench           # time every backend
+    python -m chessnut.render_bench --update  # rewrite the golden images
+"""
+import os
+import sys
+import time
+from io import BytesIO
+from PIL import Image, ImageChops
+
+from . import generate_board
+from .chess import positions
+from .encoding import encode
+from .generate_board import start
+
+GOLDEN = os.path.join(os.path.dirname(__file__), 'golden_boards')
+
+_kingside = list(positions(
+    '1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O Nf6 5. d3 O-O'))
+_queenside = list(positions(
+    '1. d4 d5 2. Nc3 Nc6 3. Bf4 Bf5 4. Qd2 Qd7 5. O-O-O O-O-O'))
+
+#name: image string
+CORPUS = {
+    'start': start,
+    'empty': '0' * 64,
+    'move': _kingside[0],
+    'capture': list(positions('1. e4 d5 2. exd5'))[-1],
+    'white_kingside': _kingside[6],
+    'black_kingside': _kingside[-1],
+    'white_queenside': _queenside[-2],
+    'black_queenside': _queenside[-1],
+    'promotion': 'Q000k000' + '0' * 48 + '0000K000' + '0100',
+}
+
+
+def backends():
+    """Returns the names of the renderers that can run here."""
+    from . import array_board
+    return ['pil'] + (['numpy'] if array_board.numpy is not None else [])
+
+
+def render(state, backend='pil'):
+    """Renders state from scratch with the named backend."""
+    if backend == 'numpy':
+        from . import array_board
+        return array_board.render(state)
+    return generate_board._pil(state)
+
+
+def golden(name):
+    return Image.open(os.path.join(GOLDEN, '%s.png' % name)).convert('RGBA')
+
+
+def difference(a, b):
+    """Returns the largest per-channel difference between two boards."""
+    if a.size != b.size:
+        return 255
+    diff = ImageChops.difference(a.convert('RGBA'), b.convert('RGBA'))
+    return max(high for low, high in diff.getextrema())
+
+
+def update():
+    """Rewrites the golden images with the PIL renderer."""
+    for name, state in sorted(CORPUS.items()):
+        render(state).save(os.path.join(GOLDEN, '%s.png' % name))
+
+
+def benchmark(rounds=20, fmt='png'):
+    """Times every backend over the corpus. Returns, per backend, renders
+    per second and mean encoded bytes per board.
+    """
+    report = {}
+    for backend in backends():
+        began = time.time()
+        for i in xrange(rounds):
+            for state in CORPUS.values():
+                render(state, backend)
+        seconds = time.time() - began
+        size = sum(encode(render(state, backend), BytesIO(), fmt)[0]
+                   for state in CORPUS.values())
+        report[backend] = {
+            'renders_per_second': rounds * len(CORPUS) / seconds,
+            'bytes': size // len(CORPUS),
+        }
+    return report
+
+
+if __name__ == '__main__':
+    if '--update' in sys.argv[1:]:
+        update()
+    else:
+        for backend, stats in sorted(benchmark().items()):
+            print('%-6s %7.1f renders/s %7d bytes' % (
+                backend, stats['renders_per_second'], stats['bytes']))
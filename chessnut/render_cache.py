@@ -0,0 +1,431 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from Queue import Queue
+from PIL import Image
+from .encoding import FORMATS, encode
+
+
+log = logging.getLogger(__name__)
+
+#subdirectories of files other than boards that count against the budget
+FILE_DIRS = ('replays',)
+
+
+def board_key(state):
+    """Returns the short content hash naming the board for state."""
+    return hashlib.sha1(state).hexdigest()[:16]
+
+
+def relative_path(state, extension='png'):
+    """Returns the sharded path of the board for state, relative to the
+    cache directory, e.g. '3f/a2/3fa2c0d9e1b4a7c6.png'.
+    """
+    key = board_key(state)
+    return os.path.join(key[:2], key[2:4], '%s.%s' % (key, extension))
+
+
+class BoardCache(object):
+    """Bounded cache of rendered boards, keyed by image string.
+
+    Rendered boards are encoded in one of encoding.FORMATS and written
+    under directory, named by a hash of the image string (see
+    relative_path). The hottest ones are also kept in memory, encoded and
+    decoded. Boards reach disk as they are put ('sync'), from a background
+    thread ('behind') or never ('off', for read-only storage). Once the
+    on-disk tier holds more than max_entries files or max_bytes bytes,
+    boards are evicted either least recently ('lru') or least frequently
+    ('lfu') used. Other files kept under directory, such as replays, can
+    be put with put_file to count against the same budget.
+    """
+
+    def __init__(self, directory='chessnut/static/boards', max_entries=20000,
+                 max_bytes=None, eviction='lru', memory_entries=64,
+                 format='png', compress_level=6, quality=85,
+                 persist='sync'):
+        if eviction not in ('lru', 'lfu'):
+            raise ValueError("Unknown eviction policy: %s" % eviction)
+        if format not in FORMATS:
+            raise ValueError("Unknown board format: %s" % format)
+        if persist not in ('sync', 'behind', 'off'):
+            raise ValueError("Unknown persist mode: %s" % persist)
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.memory_entries = memory_entries
+        self.format = format
+        self.extension, _, self.reusable_frames = FORMATS[format]
+        self.compress_level = compress_level
+        self.quality = quality
+        self.persist = persist
+        self.stats = {'hits': 0, 'memory_hits': 0, 'misses': 0,
+                      'evictions': 0, 'writes': 0, 'encoded_bytes': 0,
+                      'encode_seconds': 0.0}
+        self._lock = threading.RLock()
+        self._memory = OrderedDict()
+        self._index = None
+        #key: times used, and times used: keys used that often, least
+        #recently first, so LFU eviction finds the least used at once
+        self._uses = {}
+        self._by_uses = {}
+        self._bytes = 0
+        self._pending = Queue()
+        self._writer = None
+
+    def path(self, state):
+        return os.path.join(self.directory,
+                            relative_path(state, self.extension))
+
+    def _path(self, key):
+        if os.sep in key:
+            #a file put with put_file, keyed by its relative path
+            return os.path.join(self.directory, key)
+        return os.path.join(self.directory, key[:2], key[2:4],
+                            '%s.%s' % (key, self.extension))
+
+    def _load_index(self):
+        """Rebuilds the on-disk index, oldest files first."""
+        self._index = OrderedDict()
+        self._uses = {}
+        self._by_uses = {}
+        self._bytes = 0
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.directory)
+                if relative.split(os.sep)[0] in FILE_DIRS:
+                    key = relative
+                #skips boards still in the old flat layout
+                elif name.endswith('.' + self.extension) and \
+                        len(name) == 17 + len(self.extension):
+                    key = name[:16]
+                else:
+                    continue
+                if name.endswith('.tmp'):
+                    continue
+                st = os.stat(path)
+                entries.append((st.st_mtime, key, st.st_size))
+        for mtime, key, size in sorted(entries):
+            self._index[key] = size
+            self._set_uses(key, 0)
+            self._bytes += size
+
+    def _touch(self, key):
+        self._index[key] = self._index.pop(key)
+        self._set_uses(key, self._uses.get(key, 0) + 1)
+
+    def _set_uses(self, key, uses):
+        """Records that key was used uses times, or forgets it if uses is
+        None.
+        """
+        old = self._uses.pop(key, None)
+        if old is not None:
+            keys = self._by_uses[old]
+            del keys[key]
+            if not keys:
+                del self._by_uses[old]
+        if uses is not None:
+            self._uses[key] = uses
+            self._by_uses.setdefault(uses, OrderedDict())[key] = None
+
+    def _remember(self, key, image):
+        if not self.memory_entries:
+            return
+        self._memory.pop(key, None)
+        self._memory[key] = image
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def migrate(self, path, state):
+        """Moves an already rendered PNG board at path into the cache,
+        evicting old boards if that puts it over budget.
+        """
+        if self.format != 'png':
+            self.put(state, Image.open(path))
+            os.remove(path)
+            return
+        key = board_key(state)
+        target = self._path(key)
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            os.rename(path, target)
+            size = os.path.getsize(target)
+            self._bytes += size - self._index.get(key, 0)
+            self._index[key] = size
+            if key not in self._uses:
+                self._set_uses(key, 0)
+            self._evict(key)
+
+    def __contains__(self, state):
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            key = board_key(state)
+            return key in self._memory or key in self._index
+
+    def _lookup(self, key):
+        """Returns the [image, encoded bytes] entry for key, reading it
+        from disk if it isn't held in memory, or None. The image is only
+        decoded when asked for.
+        """
+        if self._index is None:
+            self._load_index()
+        if key in self._memory:
+            self.stats['hits'] += 1
+            self.stats['memory_hits'] += 1
+            self._memory[key] = self._memory.pop(key)
+            if key in self._index:
+                self._touch(key)
+            return self._memory[key]
+        if key not in self._index:
+            #another worker process may have rendered it
+            if not os.path.isfile(self._path(key)):
+                self.stats['misses'] += 1
+                return None
+            self._index[key] = os.path.getsize(self._path(key))
+            self._bytes += self._index[key]
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except IOError:
+            #evicted by another worker
+            self._drop(key)
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self._touch(key)
+        entry = [None, data]
+        self._remember(key, entry)
+        return entry
+
+    def get(self, state):
+        """Returns the cached board for state, or None."""
+        with self._lock:
+            entry = self._lookup(board_key(state))
+            if entry is None:
+                return None
+            if entry[0] is None:
+                image = Image.open(BytesIO(entry[1]))
+                image.load()
+                if image.mode != 'RGBA':
+                    image = image.convert('RGBA')
+                entry[0] = image
+            return entry[0]
+
+    def encoded(self, state):
+        """Returns the encoded bytes of the cached board for state, or
+        None.
+        """
+        with self._lock:
+            entry = self._lookup(board_key(state))
+            return entry[1] if entry is not None else None
+
+    def put(self, state, image):
+        """Encodes image as the board for state, keeps it in memory and
+        writes it to disk according to persist. Returns the encoded bytes.
+        """
+        f = BytesIO()
+        size, seconds = encode(image, f, self.format, self.compress_level,
+                               self.quality)
+        with self._lock:
+            self.stats['encoded_bytes'] += size
+            self.stats['encode_seconds'] += seconds
+        return self._store(board_key(state), [image, f.getvalue()])
+
+    def put_encoded(self, state, data):
+        """Caches data, a board already encoded in format, such as one a
+        render_pool worker returned, as the board for state.
+        """
+        return self._store(board_key(state), [None, data])
+
+    def _store(self, key, entry):
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            self._remember(key, entry)
+        if self.persist == 'sync':
+            self._write(key, entry[1])
+        elif self.persist == 'behind':
+            self._write_behind(key, entry[1])
+        return entry[1]
+
+    def _write(self, key, data):
+        """Atomically writes an encoded board and evicts old boards if the
+        cache is over budget.
+        """
+        path = self._path(key)
+        with self._lock:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fd, tmp = tempfile.mkstemp(suffix='.tmp',
+                                       dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.rename(tmp, path)
+            except:
+                os.remove(tmp)
+                raise
+            self._bytes += len(data) - self._index.get(key, 0)
+            self._index[key] = len(data)
+            self._touch(key)
+            self.stats['writes'] += 1
+            self._evict(key)
+
+    def put_file(self, relative, write):
+        """Atomically writes a file other than a board to relative under
+        directory with write(f), counting it against the budget. Returns
+        its path.
+        """
+        path = self._path(relative)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+        except:
+            os.remove(tmp)
+            raise
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            os.rename(tmp, path)
+            size = os.path.getsize(path)
+            self._bytes += size - self._index.get(relative, 0)
+            self._index[relative] = size
+            self._touch(relative)
+            self.stats['writes'] += 1
+            self._evict(relative)
+        return path
+
+    def use_file(self, relative):
+        """Returns whether a file put with put_file is still cached,
+        counting it as used if it is.
+        """
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            if relative not in self._index:
+                return False
+            if not os.path.isfile(self._path(relative)):
+                self._drop(relative)
+                return False
+            self._touch(relative)
+            return True
+
+    def remove_file(self, relative):
+        """Deletes a file put with put_file."""
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            self._drop(relative)
+            try:
+                os.remove(self._path(relative))
+            except OSError:
+                pass
+
+    def _write_behind(self, key, data):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._drain)
+                self._writer.daemon = True
+                self._writer.start()
+        self._pending.put((key, data))
+
+    def _drain(self):
+        while True:
+            key, data = self._pending.get()
+            try:
+                self._write(key, data)
+            except (IOError, OSError):
+                log.exception("couldn't write board %s", key)
+            finally:
+                self._pending.task_done()
+
+    def flush(self):
+        """Blocks until every write-behind board is on disk."""
+        if self._writer is not None:
+            self._pending.join()
+
+    def _drop(self, key):
+        self._bytes -= self._index.pop(key, 0)
+        self._set_uses(key, None)
+        self._memory.pop(key, None)
+
+    def _over_budget(self):
+        if self.max_entries is not None and \
+                len(self._index) > self.max_entries:
+            return True
+        if self.max_bytes is not None and self._bytes > self.max_bytes:
+            return True
+        return False
+
+    def _victim(self, keep):
+        #the board just written is only evicted if it is all that's left
+        if self.eviction == 'lfu':
+            counts = self._by_uses.keys()
+            while counts:
+                least = min(counts)
+                for key in self._by_uses[least]:
+                    if key != keep:
+                        return key
+                counts.remove(least)
+        else:
+            for key in self._index:
+                if key != keep:
+                    return key
+        return keep
+
+    def _evict(self, keep=None):
+        while self._index and self._over_budget():
+            key = self._victim(keep)
+            self._drop(key)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            self.stats['evictions'] += 1
+
+
+def _setting(settings, key, default, convert=int):
+    value = settings.get('boards.%s' % key)
+    if value is None or not str(value).strip():
+        return default
+    return convert(value)
+
+
+def cache_from_settings(settings):
+    """Builds a BoardCache from the boards.* keys of an ini file."""
+    return BoardCache(
+        directory=_setting(settings, 'directory', 'chessnut/static/boards',
+                           str),
+        max_entries=_setting(settings, 'max_entries', 20000),
+        max_bytes=_setting(settings, 'max_bytes', None),
+        eviction=_setting(settings, 'eviction', 'lru', str),
+        memory_entries=_setting(settings, 'memory_entries', 64),
+        format=_setting(settings, 'format', 'png', str),
+        compress_level=_setting(settings, 'compress_level', 6),
+        quality=_setting(settings, 'quality', 85),
+        persist=_setting(settings, 'persist', 'sync', str),
+    )
+
+
+cache = BoardCache()
+
+
+def configure(settings):
+    """Replaces the shared board cache with one built from settings."""
+    global cache
+    cache = cache_from_settings(settings)
+    return cache
+
@@ -0,0 +1,58 @@
+import multiprocessing
+import threading
+
+from .generate_board import board
+
+
+processes = None
+_pool = None
+_lock = threading.Lock()
+
+
+def render(state, previous=None):
+    """Renders state in a worker process and returns the encoded board."""
+    return board(state, previous, buffer=True).getvalue()
+
+
+def render_pair(state):
+    """Renders state in a worker process and returns it with the encoded
+    board.
+    """
+    return state, render(state)
+
+
+def prerender(state, previous=None):
+    """Renders state into the board cache in a worker process."""
+    board(state, previous)
+
+
+def configure(settings):
+    """Sets the worker count from render.processes (default: one per
+    CPU). Takes effect the next time the pool is started.
+    """
+    global processes
+    value = settings.get('render.processes')
+    processes = int(value) if value and value.strip() else None
+
+
+def get_pool():
+    """Returns the shared render pool, starting it on first use so the
+    workers inherit the configured board cache. The app starts it before
+    any of its threads: a worker forked while one of them held a lock, such
+    as the board cache's, would copy the lock held and never render.
+    """
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = multiprocessing.Pool(processes)
+        return _pool
+
+
+def close():
+    """Stops the shared render pool, if it was started."""
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.terminate()
+            _pool = None
+
@@ -0,0 +1,146 @@
+import glob
+import os
+import re
+import struct
+from PIL import Image
+
+from . import render_cache
+from .chess import positions
+from .encoding import palette, quantize
+from .generate_board import (
+    _full,
+    _incremental,
+    changed_squares,
+    offset,
+    start,
+    )
+
+#palette entry the shared palette leaves unused (see encoding.palette)
+TRANSPARENT = 255
+
+
+def _o16(i):
+    return struct.pack('<H', i)
+
+
+def _box(squares):
+    """Returns the pixel bounding box covering squares."""
+    xs, ys = zip(*[offset(c, r) for c, r in squares])
+    return min(xs), min(ys), max(xs) + 58, max(ys) + 58
+
+
+def frames(pgn):
+    """Yields (image, (x, y)) for every position of a game, quantized to
+    the shared palette. The first image is the whole start board; every
+    later one only covers the squares its move changed and is transparent
+    elsewhere, to be drawn at (x, y) over the one before.
+    """
+    previous = start
+    image = _full(start)
+    yield quantize(image), (0, 0)
+    for state in positions(pgn):
+        image = _incremental(image, previous, state)
+        squares = changed_squares(previous, state)
+        box = _box(squares)
+        delta = Image.new('P', (box[2] - box[0], box[3] - box[1]),
+                          TRANSPARENT)
+        for c, r in squares:
+            x, y = offset(c, r)
+            square = quantize(image.crop((x, y, x + 58, y + 58)))
+            delta.paste(square, (x - box[0], y - box[1]))
+        yield delta, box[:2]
+        previous = state
+
+
+def lzw(data, min_code_size=8):
+    """Compresses a string of palette indices with GIF's variable length
+    LZW and returns the packed code stream.
+    """
+    clear, end = 1 << min_code_size, (1 << min_code_size) + 1
+    out = bytearray()
+    bits = nbits = 0
+
+    def emit(code, size):
+        bits_, nbits_ = bits | (code << nbits), nbits + size
+        while nbits_ >= 8:
+            out.append(bits_ & 0xff)
+            bits_, nbits_ = bits_ >> 8, nbits_ - 8
+        return bits_, nbits_
+
+    table = dict((chr(i), i) for i in xrange(clear))
+    next_code, size = end + 1, min_code_size + 1
+    bits, nbits = emit(clear, size)
+    w = ''
+    for c in data:
+        wc = w + c
+        if wc in table:
+            w = wc
+            continue
+        bits, nbits = emit(table[w], size)
+        if next_code < 4096:
+            table[wc] = next_code
+            next_code += 1
+            if next_code > (1 << size):
+                size += 1
+        else:
+            bits, nbits = emit(clear, size)
+            table = dict((chr(i), i) for i in xrange(clear))
+            next_code, size = end + 1, min_code_size + 1
+        w = c
+    if w:
+        bits, nbits = emit(table[w], size)
+    bits, nbits = emit(end, size)
+    if nbits:
+        out.append(bits & 0xff)
+    return bytes(out)
+
+
+def encode_gif(pgn, f, delay=100, final_delay=300):
+    """Writes an animated GIF replay of a game to f, frame deltas drawn
+    over one another. The shared board palette is the global colour
+    table. delay and final_delay are in hundredths of a second.
+    """
+    data = list(frames(pgn))
+    width, height = data[0][0].size
+    f.write(b'GIF89a' + _o16(width) + _o16(height) +
+            b'\xf7\x00\x00' +  # 256 colour global table
+            bytes(bytearray(palette().getpalette()[:768])))
+    #loop forever
+    f.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + _o16(0) + b'\x00')
+    for n, (image, (x, y)) in enumerate(data):
+        #keep each frame in place for the next one, with a transparent index
+        f.write(b'!\xf9\x04\x05' +
+                _o16(final_delay if n == len(data) - 1 else delay) +
+                chr(TRANSPARENT) + b'\x00')
+        f.write(b',' + _o16(x) + _o16(y) + _o16(image.size[0]) +
+                _o16(image.size[1]) + b'\x00\x08')
+        stream = lzw(image.tobytes())
+        for i in xrange(0, len(stream), 255):
+            block = stream[i:i + 255]
+            f.write(chr(len(block)) + block)
+        f.write(b'\x00')
+    f.write(b';')
+
+
+def replay_path(game):
+    """Returns the path of the cached replay of game at its current ply."""
+    ply = len(re.sub(r'\d+\.', ' ', game.pgn or u'').split())
+    return os.path.join(render_cache.cache.directory, 'replays',
+                        '%s-%s.gif' % (game.game_id, ply))
+
+
+def replay(game):
+    """Returns the path of an animated GIF replay of game, rendering it
+    only the first time a game is replayed at a given ply. Replays count
+    against the board cache's budget, and only a game's latest is kept.
+    """
+    cache = render_cache.cache
+    path = replay_path(game)
+    relative = os.path.relpath(path, cache.directory)
+    if not cache.use_file(relative):
+        older = '%s-*.gif' % game.game_id
+        for old in glob.glob(os.path.join(os.path.dirname(path), older)):
+            cache.remove_file(os.path.relpath(old, cache.directory))
+        cache.put_file(relative,
+                       lambda f: encode_gif((game.pgn or u'').encode(), f))
+    return path
@@ -2,7 +2,7 @@ import os
 import sys
 import transaction
 
-from sqlalchemy import engine_from_config
+from sqlalchemy import engine_from_config, inspect
 
 from pyramid.paster import (
     get_appsettings,
@@ -23,6 +23,31 @@ def usage(argv):
     sys.exit(1)
 
 
+def add_missing_columns(engine):
+    """Adds the columns models have gained since their tables were created,
+    which create_all leaves alone. Returns the (table, column) names added.
+    """
+    existing = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    tables = set(existing.get_table_names())
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        names = set(c['name'] for c in existing.get_columns(table.name))
+        for column in table.columns:
+            if column.name in names:
+                continue
+            if not column.nullable:
+                raise ValueError("Can't add non-null column %s.%s" %
+                                 (table.name, column.name))
+            engine.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                quote(table.name), quote(column.name),
+                column.type.compile(engine.dialect)))
+            added.append((table.name, column.name))
+    return added
+
+
 def main(argv=sys.argv):
     if len(argv) != 2:
         usage(argv)
@@ -31,6 +56,9 @@ def main(argv=sys.argv):
     settings = get_appsettings(config_uri)
     engine = engine_from_config(settings, 'sqlalchemy.')
     DBSession.configure(bind=engine)
+    #also upgrades a database made by an older version
+    for table, column in add_missing_columns(engine):
+        print('added %s.%s' % (table, column))
     Base.metadata.create_all(engine)
     # with transaction.manager:
         # since_id = SinceId(0)
@@ -0,0 +1,244 @@
+import argparse
+import random
+import re
+import sys
+import time
+from collections import deque
+
+import transaction
+from sqlalchemy import engine_from_config
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from ..clients import BOT
+from ..fake_twitter import FakeTwitter
+from ..models import (
+    DBSession,
+    SinceId,
+    TwUser,
+    )
+
+#lines the generated games play through, one move a tweet
+OPENINGS = [
+    '1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O Nf6 5. d3 O-O',
+    '1. d4 d5 2. Nc3 Nc6 3. Bf4 Bf5 4. Qd2 Qd7 5. O-O-O O-O-O',
+    '1. e4 c5 2. Nf3 d6 3. d4 cxd4 4. Nxd4 Nf6 5. Nc3 a6',
+    '1. d4 Nf6 2. c4 e6 3. Nc3 Bb4 4. e3 O-O 5. Bd3 d5',
+]
+
+MALFORMED = [
+    u'@%s hello there',
+    u'@%s #',
+    u'good game @%s',
+    u'@%s e4',
+]
+
+
+def moves(pgn):
+    return re.sub(r'\d+\.', ' ', pgn).split()
+
+
+class Traffic(object):
+    """An endless stream of the mentions players send the bot: challenges,
+    their acceptances, moves through one of openings and, every so often,
+    tweets that aren't commands. Up to games are played at once, their
+    tweets interleaved. next() returns the next (kind, player, game, text),
+    kind being challenge, accept, move or malformed and player a screen
+    name.
+    """
+
+    def __init__(self, bot, players, games=10, malformed=0.05,
+                 openings=OPENINGS, prefix='load', seed=None):
+        self.bot = bot
+        self.players = players
+        self.games = games
+        self.malformed = malformed
+        self.openings = [moves(pgn) for pgn in openings]
+        self.prefix = prefix
+        self.random = random.Random(seed)
+        self._active = []
+        self._started = 0
+
+    def __iter__(self):
+        return self
+
+    def _script(self):
+        """Returns the tweets of a new game, in the order they're sent."""
+        self._started += 1
+        game = '%s%s' % (self.prefix, self._started)
+        owner, opponent = self.random.sample(self.players, 2)
+        tweets = deque([
+            ('challenge', owner, game,
+             u'@%s @%s #%s' % (self.bot, opponent, game)),
+            ('accept', opponent, game,
+             u'@%s @%s #%s' % (self.bot, owner, game)),
+        ])
+        for ply, move in enumerate(self.random.choice(self.openings)):
+            tweets.append(('move', (owner, opponent)[ply % 2], game,
+                           u'@%s #%s %s' % (self.bot, game, move)))
+        return tweets
+
+    def next(self):
+        if self.random.random() < self.malformed:
+            return ('malformed', self.random.choice(self.players), None,
+                    self.random.choice(MALFORMED) % self.bot)
+        if len(self._active) < self.games:
+            self._active.append(self._script())
+        script = self.random.choice(self._active)
+        tweet = script.popleft()
+        if not script:
+            self._active.remove(script)
+        return tweet
+
+
+def replay(server, traffic, user_ids, rate, seconds, clock=time.time,
+           sleep=time.sleep):
+    """Tweets traffic's mentions at server, rate a second for seconds.
+    user_ids maps screen names to their ids. Returns the (time, kind,
+    player, game, text) of every mention sent.
+    """
+    sent = []
+    began = clock()
+    while clock() < began + seconds:
+        due = began + len(sent) / float(rate)
+        if due > clock():
+            sleep(due - clock())
+        kind, player, game, text = traffic.next()
+        server.tweet(user_ids[player], text)
+        sent.append((clock(), kind, player, game, text))
+    return sent
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def report(sent, posted, user_ids):
+    """Works out how fast the bot answered the mentions sent. A move is
+    answered by its player's tweet of the board and an acceptance by the
+    bot's game start tweet, the first tagged with the game after it.
+    Returns a dict of counts, throughput and latency percentiles.
+    """
+    posted = sorted(posted)
+    replies = {}
+    for at, user_id, text, media in posted:
+        for tag in re.findall(r'#(\w+)', text):
+            replies.setdefault(tag, []).append((at, user_id))
+    latencies = []
+    unanswered = 0
+    for at, kind, player, game, text in sent:
+        if kind not in ('move', 'accept'):
+            continue
+        answer = None
+        for reply in replies.get(game, []):
+            if reply[0] >= at and (kind == 'accept' or
+                                   reply[1] == user_ids[player]):
+                answer = reply
+                break
+        if answer is None:
+            unanswered += 1
+        else:
+            replies[game].remove(answer)
+            latencies.append(answer[0] - at)
+    span = (posted[-1][0] - sent[0][0]) if posted and sent else 0
+    return {
+        'sent': len(sent),
+        'posted': len(posted),
+        'media': len([p for p in posted if p[3]]),
+        'answered': len(latencies),
+        'unanswered': unanswered,
+        'posted_per_second': len(posted) / span if span > 0 else None,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_max': max(latencies) if latencies else None,
+    }
+
+
+def seed(server, players, bot_name):
+    """Registers the bot and players accounts with server, adding TwUser
+    rows for any missing, and returns a dict of screen name to user id.
+    """
+    user_ids = {}
+    with transaction.manager:
+        bot = TwUser.get_by_id(BOT)
+        if bot is None:
+            bot = TwUser(u'load-bot', u'load-bot-secret', 1, bot_name)
+            bot.id = BOT
+            DBSession.add(bot)
+        server.add_user(bot.user_id, bot_name, bot.key)
+        user_ids[bot_name] = bot.user_id
+        for n in xrange(players):
+            name = u'loadplayer%s' % n
+            user = TwUser.get_by_screen_name(name)
+            if user is None:
+                user = TwUser(u'load-key-%s' % n, u'load-secret-%s' % n,
+                              10 ** 12 + n, name)
+                DBSession.add(user)
+            server.add_user(user.user_id, name, user.key)
+            user_ids[name] = user.user_id
+        since_id = SinceId.get_by_id(1)
+        if since_id is None:
+            since_id = SinceId(0)
+            since_id.id = 1
+            DBSession.add(since_id)
+        server.next_id = max(server.next_id, since_id.value + 1)
+    return user_ids
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        description="Stands in for Twitter and replays a stream of "
+                    "mentions at a chessnut app pointed at it with "
+                    "twitter.api_host, twitter.upload_host and "
+                    "twitter.api_secure = false.")
+    parser.add_argument('config_uri')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--rate', type=float, default=5,
+                        help="mentions a second")
+    parser.add_argument('--seconds', type=float, default=60,
+                        help="how long to send mentions for")
+    parser.add_argument('--drain', type=float, default=60,
+                        help="how long to wait for replies afterwards")
+    parser.add_argument('--players', type=int, default=20)
+    parser.add_argument('--games', type=int, default=10,
+                        help="games played at once")
+    parser.add_argument('--malformed', type=float, default=0.05,
+                        help="fraction of tweets that aren't commands")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="seconds each API call takes")
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--window', type=float, default=900,
+                        help="seconds in a rate limit window")
+    parser.add_argument('--bot', default=u'ChessnutApp',
+                        help="the bot's screen name")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv[1:])
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri)
+    for key in ('twitter.api_host', 'twitter.upload_host'):
+        if settings.get(key) != '127.0.0.1:%s' % args.port:
+            print('warning: %s is not 127.0.0.1:%s' % (key, args.port))
+    engine = engine_from_config(settings, 'sqlalchemy.')
+    DBSession.configure(bind=engine)
+
+    server = FakeTwitter(port=args.port, latency=args.latency,
+                         jitter=args.jitter, window=args.window,
+                         api_root=settings.get('twitter.api_root') or '/1.1')
+    user_ids = seed(server, args.players, args.bot)
+    server.start()
+    traffic = Traffic(args.bot, [n for n in user_ids if n != args.bot],
+                      args.games, args.malformed,
+                      prefix='load%x' % int(time.time()), seed=args.seed)
+    sent = replay(server, traffic, user_ids, args.rate, args.seconds)
+    time.sleep(args.drain)
+    server.stop()
+    results = report(sent, list(server.posted), user_ids)
+    results.update(server.stats)
+    for name in sorted(results):
+        print('%-18s %s' % (name, results[name]))
@@ -0,0 +1,46 @@
+import os
+import re
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from .. import render_cache
+
+
+IMAGE_STRING = re.compile(r'^[rnbqkpRNBQKP0]{64}(\d{4}|[WB][KQ]C)?$')
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [<old_directory>]\n'
+          '(example: "%s development.ini chessnut/static/boards")'
+          % (cmd, cmd))
+    sys.exit(1)
+
+
+def migrate(cache, directory):
+    """Moves boards saved flat as <image string>.png in directory into
+    cache's hashed layout. Returns the number of boards moved.
+    """
+    moved = 0
+    for name in os.listdir(directory):
+        state, ext = os.path.splitext(name)
+        if ext != '.png' or not IMAGE_STRING.match(state):
+            continue
+        cache.migrate(os.path.join(directory, name), state)
+        moved += 1
+    return moved
+
+
+def main(argv=sys.argv):
+    if len(argv) not in (2, 3):
+        usage(argv)
+    config_uri = argv[1]
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri)
+    cache = render_cache.configure(settings)
+    directory = argv[2] if len(argv) == 3 else cache.directory
+    print('moved %d boards' % migrate(cache, directory))
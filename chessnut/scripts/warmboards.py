@@ -0,0 +1,131 @@
+import argparse
+import multiprocessing
+import re
+import sys
+import time
+from collections import Counter
+
+from sqlalchemy import engine_from_config
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from ..models import (
+    DBSession,
+    Game,
+    )
+from ..chess import (
+    positions,
+    ChessnutError,
+    )
+from ..generate_board import start
+from .. import (
+    generate_board,
+    render_cache,
+    render_pool,
+    )
+
+
+def read_pgn_file(f):
+    """Yields the movetext of every game in a PGN file, normalized to the
+    '1. e4 e5 2. Nf3' form ChessnutGame reads.
+    """
+    movetext = []
+    for line in f:
+        line = line.strip()
+        if line.startswith('['):
+            if movetext:
+                yield normalize_movetext(' '.join(movetext))
+                movetext = []
+        elif line:
+            movetext.append(line)
+    if movetext:
+        yield normalize_movetext(' '.join(movetext))
+
+
+def normalize_movetext(text):
+    text = re.sub(r'\{[^}]*\}|\([^)]*\)|\$\d+|;.*', ' ', text)
+    text = re.sub(r'(1-0|0-1|1/2-1/2|\*)\s*$', '', text.strip())
+    text = re.sub(r'\d+\.\.\.', ' ', text)
+    text = re.sub(r'(\d+)\.\s*', r' \1. ', text)
+    return ' '.join(text.split())
+
+
+def count_positions(games, plies=None):
+    """Counts how often each position occurs in games, looking at no more
+    than the first plies half moves of each.
+    """
+    counts = Counter()
+    for pgn in games:
+        counts[start] += 1
+        try:
+            for ply, state in enumerate(positions(pgn)):
+                if plies is not None and ply >= plies:
+                    break
+                counts[state] += 1
+        except (ChessnutError, ValueError):
+            #keep the positions up to the move we couldn't follow
+            pass
+    return counts
+
+
+def warm(states, seconds=None, pool=None):
+    """Renders the uncached states on the render pool, stopping after
+    seconds. Returns the number of boards rendered.
+    """
+    cache = render_cache.cache
+    states = [state for state in states if state not in cache]
+    if not states:
+        return 0
+    pool = pool if pool is not None else render_pool.get_pool()
+    deadline = time.time() + seconds if seconds is not None else None
+    results = pool.imap_unordered(render_pool.prerender, states)
+    rendered = 0
+    while True:
+        try:
+            if deadline is None:
+                results.next()
+            else:
+                results.next(max(deadline - time.time(), 0))
+        except (StopIteration, multiprocessing.TimeoutError):
+            break
+        rendered += 1
+    return rendered
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        description="Pre-renders the most frequent positions into the "
+                    "board cache.")
+    parser.add_argument('config_uri')
+    parser.add_argument('pgn_file', nargs='?',
+                        help="mine this PGN file instead of stored games")
+    parser.add_argument('--limit', type=int, default=1000,
+                        help="number of positions to render")
+    parser.add_argument('--plies', type=int, default=30,
+                        help="half moves to follow into each game")
+    parser.add_argument('--seconds', type=float, default=None,
+                        help="stop rendering after this long")
+    args = parser.parse_args(argv[1:])
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri)
+    #the workers write boards as they render them; written behind, they'd
+    #be lost when the pool is stopped, and kept in memory only, with it
+    render_cache.configure(dict(settings, **{'boards.persist': 'sync'}))
+    render_pool.configure(settings)
+    generate_board.configure(settings)
+    if args.pgn_file:
+        with open(args.pgn_file) as f:
+            counts = count_positions(read_pgn_file(f), args.plies)
+    else:
+        engine = engine_from_config(settings, 'sqlalchemy.')
+        DBSession.configure(bind=engine)
+        games = (pgn for (pgn,) in DBSession.query(Game.pgn))
+        counts = count_positions((pgn.encode() for pgn in games if pgn),
+                                 args.plies)
+    states = [state for state, n in counts.most_common(args.limit)]
+    rendered = warm(states, args.seconds)
+    render_pool.close()
+    print('rendered %d of %d positions' % (rendered, len(states)))
@@ -0,0 +1,26 @@
+import unittest
+from chessnut import array_board
+from chessnut.chess import positions
+from chessnut.generate_board import _pil, start
+
+
+@unittest.skipIf(array_board.numpy is None, "numpy is not installed")
+class TestArrayBoard(unittest.TestCase):
+    """Test that the numpy backend matches the PIL renderer exactly."""
+    def assertSameBoard(self, state):
+        self.assertEqual(array_board.render(state).tobytes(),
+                         _pil(state).tobytes())
+
+    def test_start(self):
+        self.assertSameBoard(start)
+
+    def test_moves_and_castling(self):
+        for state in positions('1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O Nf6'):
+            self.assertSameBoard(state)
+
+    def test_empty_board(self):
+        self.assertSameBoard('0' * 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
-from chess import ChessnutGame, MoveNotLegalError, MoveAmbiguousError
+from chess import ChessnutGame, MoveNotLegalError, MoveAmbiguousError, \
+    positions
 
 
 class TestBoardToImageString(unittest.TestCase):
@@ -597,5 +598,19 @@ class TestIsCheckmate(unittest.TestCase):
             self.assertFalse(self.c._is_checkmate(0, 0))
 
 
+class TestPositions(unittest.TestCase):
+    """Test positions."""
+    def test_positions_match_reconstruction(self):
+        pgn = '1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O'
+        states = list(positions(pgn))
+        self.assertEqual(len(states), 7)
+        self.assertEqual(states[0][64:], '4644')
+        self.assertEqual(states[-1], ChessnutGame(pgn).image_string)
+        self.assertEqual(states[-1][64:], 'WKC')
+
+    def test_empty_game(self):
+        self.assertEqual(list(positions('')), [])
+
+
 if __name__ == '__main__':
     unittest.main()
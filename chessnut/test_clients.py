@@ -0,0 +1,76 @@
+import threading
+import unittest
+
+from chessnut.clients import BOT, ClientRegistry
+
+
+class User(object):
+
+    def __init__(self, id, key, secret):
+        self.id = id
+        self.key = key
+        self.secret = secret
+
+
+class TestClientRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.built = []
+        self.registry = ClientRegistry(self.factory)
+
+    def factory(self, key, secret):
+        self.built.append((key, secret))
+        return object()
+
+    def test_cached(self):
+        user = User(5, u'k', u's')
+        self.assertIs(self.registry.get(user), self.registry.get(user))
+        self.assertEqual(self.built, [(u'k', u's')])
+        self.assertEqual(self.registry.stats, {'hits': 1, 'builds': 1})
+
+    def test_per_user(self):
+        a = self.registry.get(User(5, u'k', u's'))
+        b = self.registry.get(User(6, u'k2', u's2'))
+        self.assertIsNot(a, b)
+
+    def test_new_tokens_rebuild(self):
+        old = self.registry.get(User(5, u'k', u's'))
+        new = self.registry.get(User(5, u'k', u'fresh'))
+        self.assertIsNot(old, new)
+        self.assertEqual(self.built, [(u'k', u's'), (u'k', u'fresh')])
+
+    def test_bot_looked_up_once(self):
+        lookups = []
+
+        def lookup(id):
+            lookups.append(id)
+            return User(id, u'bk', u'bs')
+        self.assertIs(self.registry.bot(lookup), self.registry.bot(lookup))
+        self.assertEqual(lookups, [BOT])
+        self.registry.invalidate(BOT)
+        self.registry.bot(lookup)
+        self.assertEqual(lookups, [BOT, BOT])
+
+    def test_invalidate_all(self):
+        user = User(5, u'k', u's')
+        self.registry.get(user)
+        self.registry.invalidate()
+        self.registry.get(user)
+        self.assertEqual(len(self.built), 2)
+
+    def test_concurrent_get(self):
+        user = User(5, u'k', u's')
+        clients = []
+        threads = [threading.Thread(
+            target=lambda: clients.append(self.registry.get(user)))
+            for i in xrange(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.built), 1)
+        self.assertEqual(len(set(map(id, clients))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import threading
+import time
+import unittest
+
+from chessnut import dispatch
+from chessnut.dispatch import CONTROL, Dispatcher, lane
+
+
+class Tweet(object):
+
+    def __init__(self, id, text):
+        self.id = id
+        self.text = text
+
+
+class TestLane(unittest.TestCase):
+
+    def test_move(self):
+        self.assertEqual(lane(Tweet(1, u'@ChessnutApp #game1 e4')), u'game1')
+
+    def test_challenge(self):
+        self.assertEqual(lane(Tweet(1, u'@ChessnutApp @bob #game1')),
+                         CONTROL)
+
+    def test_malformed(self):
+        self.assertEqual(lane(Tweet(1, u'hello there')), CONTROL)
+
+
+class TestDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.log = []
+        self.running = 0
+        self.overlap = 0
+
+    def process(self, tweets):
+        with self.lock:
+            self.running += 1
+            self.overlap = max(self.overlap, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.log.append([t.id for t in tweets])
+            self.running -= 1
+
+    def dispatcher(self, workers=4):
+        dispatcher = Dispatcher(workers, process=self.process)
+        self.addCleanup(dispatcher.close)
+        return dispatcher
+
+    def test_partition_in_id_order(self):
+        lanes = self.dispatcher().partition([
+            Tweet(3, u'@ChessnutApp #a e5'),
+            Tweet(1, u'@ChessnutApp #a e4'),
+            Tweet(2, u'@ChessnutApp #b d4'),
+            Tweet(4, u'nonsense'),
+        ])
+        self.assertEqual(dict((k, [t.id for t in v])
+                              for k, v in lanes.items()),
+                         {u'a': [1, 3], u'b': [2], CONTROL: [4]})
+
+    def test_games_concurrent(self):
+        self.dispatcher().dispatch([
+            Tweet(i, u'@ChessnutApp #g%s e4' % i) for i in xrange(4)])
+        self.assertEqual(sorted(self.log), [[0], [1], [2], [3]])
+        self.assertTrue(self.overlap > 1)
+
+    def test_challenged_game_waits(self):
+        self.dispatcher().dispatch([
+            Tweet(1, u'@ChessnutApp @bob #new'),
+            Tweet(2, u'@ChessnutApp #new e4'),
+            Tweet(3, u'@ChessnutApp #other d4'),
+        ])
+        self.assertTrue(self.log.index([1]) < self.log.index([2]))
+        self.assertEqual(len(self.log), 3)
+
+    def test_failed_lane_isolated(self):
+        def process(tweets):
+            if tweets[0].id == 1:
+                raise ValueError("bad lane")
+            self.log.append([t.id for t in tweets])
+        dispatcher = Dispatcher(2, process=process)
+        self.addCleanup(dispatcher.close)
+        dispatcher.dispatch([Tweet(1, u'@ChessnutApp #a e4'),
+                             Tweet(2, u'@ChessnutApp #b e4')])
+        self.assertEqual(self.log, [[2]])
+        self.assertEqual(dispatcher.stats['failed'], 1)
+        self.assertEqual(dispatcher.stats['unplayed'], 1)
+
+
+class FakeBatch(object):
+
+    @classmethod
+    def load(cls, tweets, parse):
+        return cls()
+
+    def attach(self):
+        pass
+
+
+class TestProcess(unittest.TestCase):
+
+    def setUp(self):
+        self.played = []
+        for name, value in (('play', self.play), ('Batch', FakeBatch)):
+            self.addCleanup(setattr, dispatch, name, getattr(dispatch, name))
+            setattr(dispatch, name, value)
+
+    def play(self, tweet, batch):
+        if tweet.id == 2:
+            raise IOError("down")
+        self.played.append(tweet.id)
+        return (u'board%s' % tweet.id, None)
+
+    def unplayed(self, tweets):
+        return [getattr(t, 'unplayed', None) for t in tweets]
+
+    def test_game_stalls_after_failure(self):
+        tweets = [Tweet(i, u'@ChessnutApp #a e4') for i in xrange(1, 4)]
+        self.assertEqual(dispatch.process(tweets), [(u'board1', None, 1)])
+        self.assertEqual(self.played, [1])
+        self.assertEqual(self.unplayed(tweets), [None, 'failed', 'stalled'])
+
+    def test_control_carries_on(self):
+        tweets = [Tweet(i, u'nonsense') for i in xrange(1, 4)]
+        dispatch.process(tweets)
+        self.assertEqual(self.played, [1, 3])
+        self.assertEqual(self.unplayed(tweets), [None, 'failed', None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import unittest
+
+import transaction
+from transaction.interfaces import DoomedTransaction
+
+from chessnut import error_replies, identities, outbox, twitter
+from chessnut.error_replies import ErrorReplies
+
+
+class TestErrorReplies(unittest.TestCase):
+
+    def test_coalesced_per_user(self):
+        replies = ErrorReplies()
+        self.assertTrue(replies.add(1, 'format', now=0))
+        self.assertFalse(replies.add(1, 'format', now=0))
+        self.assertTrue(replies.add(1, 'notyourturn', now=0))
+        self.assertTrue(replies.add(2, 'format', now=0))
+        self.assertEqual(replies.take(),
+                         [(1, ['format', 'notyourturn']), (2, ['format'])])
+        self.assertEqual(replies.take(), [])
+        self.assertEqual(replies.stats['coalesced'], 1)
+
+    def test_cooldown(self):
+        replies = ErrorReplies(cooldown=60)
+        replies.add(1, 'format', now=0)
+        replies.told(*replies.take()[0], now=0)
+        self.assertFalse(replies.add(1, 'format', now=30))
+        self.assertTrue(replies.add(1, 'notyourturn', now=30))
+        self.assertTrue(replies.add(2, 'format', now=30))
+        self.assertEqual(replies.take(),
+                         [(1, ['notyourturn']), (2, ['format'])])
+        self.assertTrue(replies.add(1, 'format', now=60))
+        self.assertEqual(replies.stats['suppressed'], 1)
+        self.assertEqual(replies.stats['replies'], 1)
+
+    def test_no_cooldown_until_told(self):
+        replies = ErrorReplies(cooldown=60)
+        replies.add(1, 'format', now=0)
+        replies.take()
+        self.assertTrue(replies.add(1, 'format', now=1))
+
+    def test_restore(self):
+        replies = ErrorReplies()
+        replies.add(1, 'format', now=0)
+        replies.add(1, 'notyourturn', now=0)
+        owed = replies.take()
+        replies.add(1, 'register', now=0)
+        replies.add(1, 'format', now=0)
+        replies.restore(*owed[0])
+        self.assertEqual(replies.take(),
+                         [(1, ['format', 'notyourturn', 'register'])])
+
+    def test_cooldowns_forgotten(self):
+        replies = ErrorReplies(cooldown=60)
+        replies.told(1, ['format'], now=0)
+        replies.told(2, ['format'], now=60)
+        self.assertEqual(replies._told.keys(), [(2, 'format')])
+
+
+class FakeOutbox(object):
+
+    def __init__(self):
+        self.queued = []
+        self.doom = False
+
+    def enqueue(self, account, status, *args, **kwargs):
+        self.queued.append((account, status))
+        if self.doom:
+            transaction.get().doom()
+
+
+class TestSendErrors(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        for module, name, value in (
+                (error_replies, 'replies', ErrorReplies(post=True)),
+                (outbox, 'queue', FakeOutbox()),
+                (twitter, 'cn_api', lambda: self.calls.append('cn_api')),
+                (identities, 'cache', self)):
+            self.addCleanup(setattr, module, name, getattr(module, name))
+            setattr(module, name, value)
+
+    def screen_name(self, user_id, api):
+        self.calls.append(user_id)
+        if user_id == 9:
+            raise IOError("lookup failed")
+        return u'player%s' % user_id
+
+    def test_one_reply_per_user(self):
+        for i in xrange(5):
+            twitter.send_error(7, 'format')
+        twitter.send_error(7, 'notyourturn')
+        twitter.send_error(8)
+        twitter.send_errors()
+        self.assertEqual(outbox.queue.queued, [
+            (1, u"@player7 Your last tweet had formatting issues; "
+                u"it isn't your turn yet"),
+            (1, u"@player8 There was a general error"),
+        ])
+        self.assertEqual(self.calls, ['cn_api', 7, 8])
+        self.assertEqual(sorted(error_replies.replies._told), [
+            (7, 'format'), (7, 'notyourturn'), (8, 'default')])
+
+    def test_fits_in_a_tweet(self):
+        for error in sorted(twitter.error_dict):
+            twitter.send_error(7, error)
+        twitter.send_errors()
+        [(account, tweet)] = outbox.queue.queued
+        self.assertTrue(len(tweet) <= twitter.TWEET_LENGTH)
+        told = [e for u, e in error_replies.replies._told]
+        self.assertEqual(len(told) + len(error_replies.replies._owed[7]),
+                         len(twitter.error_dict))
+
+    def test_restored_if_not_committed(self):
+        outbox.queue.doom = True
+        twitter.send_error(7, 'format')
+        self.assertRaises(DoomedTransaction, twitter.send_errors)
+        self.assertEqual(error_replies.replies._told, {})
+        self.assertEqual(error_replies.replies.take(), [(7, ['format'])])
+
+    def test_restored_on_failure(self):
+        twitter.send_error(7, 'format')
+        twitter.send_error(9, 'format')
+        self.assertRaises(IOError, twitter.send_errors)
+        self.assertEqual(error_replies.replies.take(),
+                         [(7, ['format']), (9, ['format'])])
+
+    def test_nothing_owed(self):
+        twitter.send_errors()
+        self.assertEqual(self.calls, [])
+
+    def test_not_posted(self):
+        error_replies.replies.post = False
+        twitter.send_error(7, 'format')
+        twitter.send_errors()
+        self.assertEqual(outbox.queue.queued, [])
+        self.assertEqual(self.calls, [])
+        self.assertEqual(error_replies.replies.stats['replies'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+import threading
+import unittest
+import urllib2
+from io import BytesIO
+
+import transaction
+import tweepy
+from sqlalchemy import create_engine
+
+from chessnut import media, timing, twitter
+from chessnut.fake_twitter import FakeTwitter
+from chessnut.models import Base, DBSession, TwUser
+from chessnut.polling import rate_limit
+from chessnut.scripts.loadtest import Traffic, report
+from chessnut.twitter import OAuthHandler, fetch_mentions, new_api, parse
+
+BOT = 42
+
+
+class FakeTwitterCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeTwitter(limits={
+            '/statuses/mentions_timeline.json': 4})
+        self.server.add_user(BOT, u'ChessnutApp', 'bot-key')
+        self.server.add_user(7, u'alice', 'alice-key')
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        twitter.configure({'twitter.api_host': self.server.address,
+                           'twitter.upload_host': self.server.address,
+                           'twitter.api_secure': 'false'})
+        self.addCleanup(twitter.configure, {})
+
+    def api(self, key):
+        auth = OAuthHandler('consumer', 'consumer-secret')
+        auth.set_access_token(key, 'secret')
+        return new_api(auth)
+
+
+class TestFakeTwitter(FakeTwitterCase):
+
+    def test_mentions_timeline(self):
+        for i in xrange(5):
+            self.server.tweet(7, u'@ChessnutApp #g%s e4' % i)
+        self.server.tweet(BOT, u'@alice hello')
+        api = self.api('bot-key')
+        found = []
+
+        class Found(object):
+            put = found.append
+        self.assertEqual(fetch_mentions(api, None, Found, count=2), 5)
+        self.assertEqual(sorted(t.text for t in found),
+                         [u'@ChessnutApp #g%s e4' % i for i in xrange(5)])
+        self.assertEqual(found[0].user.screen_name, u'alice')
+        self.assertEqual(rate_limit(api)[:2], (0, 4))
+        self.assertRaises(tweepy.TweepError, api.mentions_timeline)
+        self.assertEqual(api.last_response.status, 429)
+        self.assertEqual(self.server.stats['throttled'], 1)
+
+    def test_rate_limit_per_thread(self):
+        api = self.api('bot-key')
+        api.mentions_timeline()
+        other = threading.Thread(target=api.mentions_timeline)
+        other.start()
+        other.join()
+        self.assertEqual(rate_limit(api)[:2], (3, 4))
+        self.assertEqual(self.server.stats['requests'], 2)
+
+    def test_post(self):
+        api = self.api('alice-key')
+        api.update_status(u'@ChessnutApp hi')
+        twitter.update_status(api, u'@bob #g1',
+                              twitter.upload_media(api, BytesIO(b'board')))
+        self.assertEqual([p[1:3] for p in self.server.posted],
+                         [(7, u'@ChessnutApp hi'), (7, u'@bob #g1')])
+        self.assertEqual(self.server.posted[0][3], 0)
+        self.assertTrue(self.server.posted[1][3] > len('board'))
+        self.assertEqual([t.text for t in
+                          self.api('bot-key').mentions_timeline()],
+                         [u'@ChessnutApp hi'])
+
+    def test_users(self):
+        api = self.api('bot-key')
+        self.assertEqual(api.get_user(user_id=7).screen_name, u'alice')
+        self.assertEqual(api.get_user(screen_name='ALICE').id, 7)
+        self.assertEqual(api.me().id, BOT)
+        self.assertRaises(tweepy.TweepError, api.get_user, user_id=8)
+
+    def test_unknown_token(self):
+        self.assertRaises(tweepy.TweepError,
+                          self.api('stolen').update_status, u'hi')
+        self.assertEqual(self.server.posted, [])
+        self.assertEqual(self.server.stats['unauthorized'], 1)
+
+    def test_oauth(self):
+        auth = OAuthHandler('consumer', 'consumer-secret')
+        url = auth.get_authorization_url()
+        self.assertTrue(url.startswith('http://%s/oauth/authorize'
+                                       % self.server.address))
+        verifier = urllib2.urlopen(url + '&screen_name=carol').read()
+        auth.get_access_token(verifier)
+        me = new_api(auth).me()
+        self.assertEqual(me.screen_name, u'carol')
+        self.assertEqual(self.server.tokens[auth.access_token.key], me.id)
+
+    def test_media_ids(self):
+        api = self.api('alice-key')
+        media_id = twitter.upload_media(api, BytesIO(b'board'))
+        twitter.update_status(api, u'@bob #g1', media_id)
+        self.assertRaises(tweepy.TweepError, twitter.update_status,
+                          self.api('bot-key'), u'@bob #g1', media_id)
+        self.server.media_ttl = 0
+        expired = twitter.upload_media(api, BytesIO(b'board'))
+        self.assertRaises(tweepy.TweepError, twitter.update_status, api,
+                          u'@bob #g2', expired)
+        self.assertEqual(len(self.server.posted), 1)
+        self.assertEqual(self.server.posted[0][3],
+                         self.server.stats['uploaded_bytes'] / 2)
+
+
+class Outbound(object):
+
+    def __init__(self, account, status, board):
+        self.account = account
+        self.status = status
+        self.board = board
+        self.previous = None
+        self.mention_id = None
+
+
+class TestPostTweet(FakeTwitterCase):
+
+    def setUp(self):
+        FakeTwitterCase.setUp(self)
+        engine = create_engine('sqlite://')
+        DBSession.configure(bind=engine)
+        Base.metadata.create_all(engine)
+        self.addCleanup(DBSession.remove)
+        with transaction.manager:
+            DBSession.add(TwUser(u'alice-key', u'secret', 7, u'alice'))
+        self.addCleanup(setattr, media, 'cache', media.cache)
+        media.cache = media.MediaCache()
+        self.rendered = []
+        self.addCleanup(setattr, twitter, 'board', twitter.board)
+        twitter.board = lambda state, previous, buffer: \
+            self.rendered.append(state) or BytesIO(b'board')
+
+    def post(self, status, board):
+        with transaction.manager:
+            twitter.post_tweet(Outbound(1, status, board))
+
+    def test_board_uploaded_once(self):
+        self.post(u'@bob #g1', u'a')
+        self.post(u'@bob #g2', u'a')
+        self.post(u'@bob #g3', u'b')
+        self.post(u'@bob hello', None)
+        self.assertEqual(self.rendered, [u'a', u'b'])
+        self.assertEqual(self.server.stats['uploads'], 2)
+        self.assertEqual([bool(p[3]) for p in self.server.posted],
+                         [True, True, True, False])
+
+    def test_expired_media_uploaded_again(self):
+        self.post(u'@bob #g1', u'a')
+        self.server.media.clear()
+        self.post(u'@bob #g2', u'a')
+        self.assertEqual(self.rendered, [u'a', u'a'])
+        self.assertEqual(len(self.server.posted), 2)
+
+    def test_upload_timed(self):
+        self.addCleanup(setattr, timing, 'timings', timing.timings)
+        timing.timings = timing.Timings()
+        timing.timings.mark(5, 'fetched', 0)
+        tweet = Outbound(1, u'@bob #g1', u'a')
+        tweet.mention_id = 5
+        with transaction.manager:
+            twitter.post_tweet(tweet)
+        self.assertEqual(timing.timings.metrics().keys(),
+                         ['uploaded', 'posted', 'total'])
+
+    def test_other_errors_raised(self):
+        self.post(u'@bob #g1', u'a')
+        self.assertRaises(tweepy.TweepError, self.post, u'', u'a')
+        self.assertEqual(self.rendered, [u'a'])
+        self.assertEqual(self.server.stats['uploads'], 1)
+        self.assertNotEqual(media.cache.get(1, u'a'), None)
+
+    def test_error_codes(self):
+        with self.assertRaises(tweepy.TweepError) as raised:
+            self.api('alice-key').get_user(user_id=8)
+        self.assertEqual(twitter.error_codes(raised.exception), [50])
+        self.assertEqual(twitter.error_codes(tweepy.TweepError('down')), [])
+
+
+class Tweet(object):
+
+    def __init__(self, text):
+        self.text = text
+
+
+class TestTraffic(unittest.TestCase):
+
+    def test_games_in_order(self):
+        traffic = Traffic(u'ChessnutApp', [u'a', u'b', u'c'], games=3,
+                          malformed=0.2, seed=1)
+        seen = {}
+        for i in xrange(200):
+            kind, player, game, text = traffic.next()
+            parsed = parse(Tweet(text))
+            if kind == 'malformed':
+                self.assertEqual(parsed, None)
+                continue
+            self.assertEqual(parsed['game'], game)
+            seen.setdefault(game, []).append((kind, player))
+        for game, tweets in seen.items():
+            kinds = [k for k, p in tweets]
+            self.assertEqual(kinds[:2], ['challenge', 'accept'])
+            self.assertTrue(set(kinds[2:]) <= set(['move']))
+            owner, opponent = tweets[0][1], tweets[1][1]
+            self.assertNotEqual(owner, opponent)
+            for ply, (kind, player) in enumerate(tweets[2:]):
+                self.assertEqual(player, (owner, opponent)[ply % 2])
+        self.assertTrue(len(seen) > 3)
+
+    def test_report(self):
+        user_ids = {u'a': 1, u'b': 2}
+        sent = [(10.0, 'accept', u'b', u'g1', u''),
+                (11.0, 'move', u'a', u'g1', u''),
+                (12.0, 'move', u'b', u'g1', u''),
+                (13.0, 'malformed', u'a', None, u'')]
+        posted = [(10.5, BOT, u'The game begins at #g1.', 0),
+                  (12.0, 1, u'@b #g1', 100)]
+        results = report(sent, posted, user_ids)
+        self.assertEqual((results['answered'], results['unanswered']),
+                         (2, 1))
+        self.assertEqual(results['latency_max'], 1.0)
+        self.assertEqual(results['media'], 1)
+        self.assertEqual(results['posted_per_second'], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
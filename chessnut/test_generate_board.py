@@ -0,0 +1,144 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from PIL import Image
+from chessnut import generate_board, render_cache, render_pool
+from chessnut.render_bench import (
+    CORPUS,
+    backends,
+    difference,
+    golden,
+    render,
+    )
+
+#largest per-channel difference allowed against a golden image
+TOLERANCE = 2
+
+
+class TestGoldenBoards(unittest.TestCase):
+    """Test every renderer against the golden images."""
+    def setUp(self):
+        self.cache = render_cache.cache
+        self.directory = tempfile.mkdtemp()
+        render_cache.cache = render_cache.BoardCache(self.directory)
+
+    def tearDown(self):
+        render_cache.cache = self.cache
+        shutil.rmtree(self.directory)
+
+    def test_backends(self):
+        for backend in backends():
+            for name, state in CORPUS.items():
+                self.assertLessEqual(
+                    difference(render(state, backend), golden(name)),
+                    TOLERANCE, '%s renders %s wrong' % (backend, name))
+
+    def test_incremental(self):
+        previous = CORPUS['start']
+        image = generate_board.board(CORPUS['move'], previous,
+                                     frame=golden('start'))
+        self.assertLessEqual(difference(image, golden('move')), TOLERANCE)
+        image = generate_board.board(CORPUS['black_kingside'],
+                                     CORPUS['white_kingside'],
+                                     frame=golden('white_kingside'))
+        self.assertLessEqual(difference(image, golden('black_kingside')),
+                             TOLERANCE)
+
+    def test_buffer(self):
+        f = generate_board.board(CORPUS['capture'], buffer=True)
+        self.assertLessEqual(difference(Image.open(f), golden('capture')),
+                             TOLERANCE)
+
+
+class TestBoardMany(unittest.TestCase):
+    """Test batch rendering."""
+    def setUp(self):
+        self.cache = render_cache.cache
+        self.directory = tempfile.mkdtemp()
+        render_cache.cache = render_cache.BoardCache(self.directory)
+        self.names = ['start', 'move', 'start', 'capture', 'move']
+
+    def tearDown(self):
+        render_pool.close()
+        render_cache.cache = self.cache
+        shutil.rmtree(self.directory)
+
+    def check(self, results, buffer=False):
+        expected = dict((CORPUS[name], name) for name in self.names)
+        self.assertEqual(sorted(state for state, image in results),
+                         sorted(expected))
+        for state, image in results:
+            if buffer:
+                image = Image.open(image)
+            self.assertLessEqual(difference(image, golden(expected[state])),
+                                 TOLERANCE)
+
+    def test_in_order(self):
+        states = [CORPUS[name] for name in self.names]
+        results = list(generate_board.board_many(states))
+        self.assertEqual([state for state, image in results],
+                         [CORPUS['start'], CORPUS['move'], CORPUS['capture']])
+        self.check(results)
+
+    def test_lossy_frames_not_reused(self):
+        render_cache.cache = render_cache.BoardCache(self.directory,
+                                                     format='jpeg')
+        generate_board.board(CORPUS['start'])
+        repaints = []
+        incremental = generate_board._incremental
+        self.addCleanup(setattr, generate_board, '_incremental', incremental)
+        generate_board._incremental = \
+            lambda *args: repaints.append(args) or incremental(*args)
+        list(generate_board.board_many([CORPUS['start'], CORPUS['move']]))
+        self.assertEqual(repaints, [])
+
+    def test_buffer(self):
+        states = [CORPUS[name] for name in self.names]
+        self.check(list(generate_board.board_many(states, buffer=True)),
+                   buffer=True)
+
+    def test_buffer_uncached(self):
+        render_cache.cache = render_cache.BoardCache(
+            self.directory, memory_entries=0, persist='off')
+        states = [CORPUS[name] for name in self.names]
+        self.check(list(generate_board.board_many(states, buffer=True)),
+                   buffer=True)
+
+    def test_parallel(self):
+        states = [CORPUS[name] for name in self.names]
+        self.check(list(generate_board.board_many(states, parallel=True)))
+
+
+class TestRenderPool(unittest.TestCase):
+
+    def setUp(self):
+        self.started = []
+        pool = render_pool.multiprocessing.Pool
+        self.addCleanup(setattr, render_pool.multiprocessing, 'Pool', pool)
+        render_pool.multiprocessing.Pool = self.Pool
+        self.addCleanup(render_pool.close)
+
+    def Pool(self, processes):
+        time.sleep(0.05)
+        self.started.append(processes)
+        return self
+
+    def terminate(self):
+        self.started.append('terminated')
+
+    def test_started_once(self):
+        threads = [threading.Thread(target=render_pool.get_pool)
+                   for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.started, [render_pool.processes])
+        render_pool.close()
+        self.assertEqual(self.started[1:], ['terminated'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import transaction
+from sqlalchemy import create_engine
+
+from chessnut.identities import IdentityCache
+from chessnut.models import Base, DBSession, TwUser
+
+
+class User(object):
+
+    def __init__(self, id, screen_name):
+        self.id = id
+        self.screen_name = screen_name
+
+
+class Tweet(object):
+
+    def __init__(self, user, mentions=()):
+        self.user = user
+        self.entities = {'user_mentions': [
+            {'id': u.id, 'screen_name': u.screen_name} for u in mentions]}
+
+
+class FakeApi(object):
+
+    def __init__(self, *users):
+        self.users = users
+        self.calls = []
+
+    def get_user(self, id):
+        self.calls.append(id)
+        for user in self.users:
+            if id in (user.id, user.screen_name):
+                return user
+
+
+class TestIdentityCache(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        DBSession.configure(bind=engine)
+        Base.metadata.create_all(engine)
+        transaction.begin()
+        self.cache = IdentityCache(ttl=100)
+        self.api = FakeApi(User(7, u'bob'), User(8, u'alice'))
+
+    def tearDown(self):
+        transaction.abort()
+        DBSession.remove()
+
+    def test_learns_from_tweets(self):
+        self.cache.observe(Tweet(User(7, u'bob'), [User(8, u'Alice')]))
+        self.assertEqual(self.cache.screen_name(7, self.api), u'bob')
+        self.assertEqual(self.cache.screen_name(8, self.api), u'Alice')
+        self.assertEqual(self.cache.user_id(u'alice', self.api), 8)
+        self.assertEqual(self.api.calls, [])
+        self.assertEqual(self.cache.stats, {'hits': 3, 'lookups': 0})
+
+    def test_looks_up_unknown(self):
+        self.assertEqual(self.cache.screen_name(7, self.api), u'bob')
+        self.assertEqual(self.cache.screen_name(7, self.api), u'bob')
+        self.assertEqual(self.cache.user_id(u'alice', self.api), 8)
+        self.assertEqual(self.api.calls, [7, u'alice'])
+
+    def test_expires(self):
+        self.cache.remember(7, u'bobby', now=1000)
+        self.assertEqual(self.cache.screen_name(7, self.api, now=1050),
+                         u'bobby')
+        self.assertEqual(self.cache.screen_name(7, self.api, now=1101),
+                         u'bob')
+        self.assertEqual(self.api.calls, [7])
+
+    def test_persisted_on_twuser(self):
+        twuser = TwUser(u'k', u's', 7)
+        DBSession.add(twuser)
+        self.cache.observe(Tweet(User(7, u'bob')), twuser)
+        self.assertEqual(twuser.screen_name, u'bob')
+        #a fresh process still knows registered users
+        cache = IdentityCache(ttl=100)
+        self.assertEqual(cache.screen_name(7, self.api), u'bob')
+        self.assertEqual(cache.user_id(u'BOB', self.api), 7)
+        self.assertEqual(self.api.calls, [])
+
+    def test_stale_twuser_refreshed(self):
+        twuser = TwUser(u'k', u's', 7)
+        DBSession.add(twuser)
+        self.cache.remember(7, u'robert', twuser, now=0)
+        self.assertEqual(IdentityCache(ttl=100).screen_name(7, self.api),
+                         u'bob')
+        self.assertEqual(twuser.screen_name, u'bob')
+        self.assertEqual(self.api.calls, [7])
+
+
+if __name__ == '__main__':
+    unittest.main()
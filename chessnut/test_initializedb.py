@@ -0,0 +1,30 @@
+import unittest
+
+from sqlalchemy import create_engine, inspect
+
+from chessnut.models import Base
+from chessnut.scripts.initializedb import add_missing_columns
+
+
+class TestAddMissingColumns(unittest.TestCase):
+
+    def test_upgrades_old_table(self):
+        engine = create_engine('sqlite://')
+        engine.execute('CREATE TABLE twuser (id INTEGER PRIMARY KEY, '
+                       'key TEXT, secret TEXT, user_id INTEGER)')
+        engine.execute("INSERT INTO twuser VALUES (1, 'k', 's', 7)")
+        self.assertEqual(add_missing_columns(engine),
+                         [('twuser', 'screen_name'),
+                          ('twuser', 'screen_name_checked')])
+        Base.metadata.create_all(engine)
+        self.assertEqual(
+            [c['name'] for c in inspect(engine).get_columns('twuser')],
+            ['id', 'key', 'secret', 'user_id', 'screen_name',
+             'screen_name_checked'])
+        self.assertEqual(list(engine.execute(
+            'SELECT user_id, screen_name FROM twuser')), [(7, None)])
+        self.assertEqual(add_missing_columns(engine), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from chessnut.media import MediaCache
+
+
+class TestMediaCache(unittest.TestCase):
+
+    def test_per_account(self):
+        cache = MediaCache()
+        cache.put(1, 'state', '100', now=0)
+        self.assertEqual(cache.get(1, 'state', now=0), '100')
+        self.assertEqual(cache.get(2, 'state', now=0), None)
+        self.assertEqual(cache.get(1, 'other', now=0), None)
+        self.assertEqual((cache.stats['hits'], cache.stats['misses']),
+                         (1, 2))
+
+    def test_expires(self):
+        cache = MediaCache(ttl=60)
+        cache.put(1, 'state', '100', now=0)
+        self.assertEqual(cache.get(1, 'state', now=59), '100')
+        self.assertEqual(cache.get(1, 'state', now=60), None)
+        self.assertEqual(cache.stats['expired'], 1)
+        cache.put(1, 'state', '101', now=60)
+        self.assertEqual(cache.get(1, 'state', now=61), '101')
+
+    def test_least_recently_used_evicted(self):
+        cache = MediaCache(max_entries=2)
+        cache.put(1, 'a', '1', now=0)
+        cache.put(1, 'b', '2', now=0)
+        cache.get(1, 'a', now=0)
+        cache.put(1, 'c', '3', now=0)
+        self.assertEqual(cache.get(1, 'b', now=0), None)
+        self.assertEqual(cache.get(1, 'a', now=0), '1')
+        self.assertEqual(cache.get(1, 'c', now=0), '3')
+
+    def test_forget(self):
+        cache = MediaCache()
+        cache.put(1, 'state', '100', now=0)
+        cache.forget(1, 'state')
+        cache.forget(1, 'never')
+        self.assertEqual(cache.get(1, 'state', now=0), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from chessnut.mention_stream import MentionStream
+
+BOT = 42
+
+
+def tweet(id, text, user_id=7, mentions=(BOT,)):
+    return {
+        'id': id,
+        'text': text,
+        'user': {'id': user_id, 'screen_name': 'player%s' % user_id},
+        'entities': {'user_mentions': [{'id': m} for m in mentions]},
+    }
+
+
+class FakeStream(HTTPServer):
+    """Local stand-in for the user stream. Each connection is sent the next
+    batch of messages, length delimited and chunked as Twitter sends them,
+    and then closed. A message that's a string is sent as is.
+    """
+
+    def __init__(self, batches, status=200):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StreamHandler)
+        self.batches = list(batches)
+        self.status = status
+        self.requests = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        self.send_response(self.server.status)
+        self.send_header('Connection', 'close')
+        if self.server.status != 200:
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        batch = self.server.batches.pop(0) if self.server.batches else []
+        for message in batch:
+            if not isinstance(message, str):
+                message = json.dumps(message)
+            data = '\r\n%d\r\n%s\r\n' % (len(message) + 2, message)
+            #split so messages straddle chunk boundaries
+            half = len(data) // 2
+            self.chunk(data[:half])
+            self.chunk(data[half:])
+        self.chunk('')
+
+    def chunk(self, data):
+        self.wfile.write('%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMentionStream(unittest.TestCase):
+
+    def serve(self, server):
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def stream(self, server, received, **kwargs):
+        stream = MentionStream(None, BOT, received.append, host='127.0.0.1',
+                               port=server.port, secure=False, timeout=5,
+                               **kwargs)
+        self.addCleanup(stream.stop)
+        return stream
+
+    def wait(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_delivers_mentions(self):
+        server = FakeStream([[
+            {'friends': [1, 2, 3]},
+            tweet(1, u'@chessnutbot #game1 e4'),
+            tweet(2, u'unrelated', mentions=()),
+            tweet(3, u'@player7 #game1', user_id=BOT, mentions=(BOT, 7)),
+            {'delete': {'status': {'id': 1}}},
+            tweet(4, u'@chessnutbot #game1 e5'),
+        ]])
+        self.serve(server)
+        received = []
+        self.stream(server, received, retry_time=0.01).start()
+        self.wait(lambda: len(received) == 2)
+        self.assertEqual([t.id for t in received], [1, 4])
+        self.assertEqual(received[0].text, u'@chessnutbot #game1 e4')
+        self.assertEqual(received[0].user.screen_name, u'player7')
+        self.assertTrue(server.requests[0].startswith(
+            '/1.1/user.json?delimited=length'))
+
+    def test_skips_malformed(self):
+        server = FakeStream([[
+            '{"text": ',
+            '[1, 2]',
+            tweet(1, u'@chessnutbot #game1 e4'),
+        ]])
+        self.serve(server)
+        received = []
+        stream = self.stream(server, received, retry_time=0.01)
+        stream.start()
+        self.wait(lambda: len(received) == 1)
+        self.assertEqual(stream.connections, 1)
+
+    def test_reconnects(self):
+        server = FakeStream([[tweet(1, u'first')], [tweet(2, u'second')]])
+        self.serve(server)
+        received = []
+        stream = self.stream(server, received, retry_time=0.01)
+        stream.start()
+        self.wait(lambda: len(received) == 2)
+        self.assertEqual([t.id for t in received], [1, 2])
+        self.assertTrue(stream.connections >= 2)
+
+    def test_refused_backs_off(self):
+        server = FakeStream([], status=420)
+        self.serve(server)
+        stream = self.stream(server, [], retry_time=0.05, retry_cap=0.1)
+        delays = []
+        stream._wait = delays.append
+        stream.start()
+        self.wait(lambda: len(delays) >= 3)
+        stream.stop()
+        self.assertEqual(delays[:3], [0.05, 0.1, 0.1])
+        self.assertEqual(stream.connections, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import time
+import unittest
+import transaction
+from sqlalchemy import create_engine
+
+from chessnut.models import Base, DBSession, OutboundTweet
+from chessnut.outbox import Outbox, TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=0.5, burst=2)
+        self.assertTrue(bucket.take(0))
+        self.assertTrue(bucket.take(0))
+        self.assertFalse(bucket.take(0))
+        self.assertFalse(bucket.take(1))
+        self.assertTrue(bucket.take(2))
+
+    def test_refill_capped(self):
+        bucket = TokenBucket(rate=1, burst=2)
+        bucket.take(0)
+        self.assertTrue(bucket.take(100))
+        self.assertTrue(bucket.take(100))
+        self.assertFalse(bucket.take(100))
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        DBSession.configure(bind=engine)
+        Base.metadata.create_all(engine)
+        self.posted = []
+        self.failing = set()
+
+    def tearDown(self):
+        DBSession.remove()
+
+    def post(self, tweet):
+        if tweet.status in self.failing:
+            raise IOError("twitter is down")
+        self.posted.append(tweet.status)
+
+    def queue(self, outbox, *tweets):
+        with transaction.manager:
+            for account, status in tweets:
+                outbox.enqueue(account, status)
+        self.start = time.time() + 1
+
+    def pending(self):
+        with transaction.manager:
+            return [(t.status, t.state, t.attempts)
+                    for t in DBSession.query(OutboundTweet).order_by(
+                        OutboundTweet.id)]
+
+    def test_posts_in_order(self):
+        outbox = Outbox()
+        self.queue(outbox, (1, u'a'), (2, u'b'), (1, u'c'))
+        self.assertEqual(outbox.drain(self.post, now=self.start), 3)
+        self.assertEqual(self.posted, [u'a', u'b', u'c'])
+        self.assertEqual(self.pending(), [])
+
+    def test_rolled_back_not_sent(self):
+        outbox = Outbox()
+        transaction.begin()
+        outbox.enqueue(1, u'a')
+        transaction.abort()
+        outbox.drain(self.post)
+        self.assertEqual(self.posted, [])
+
+    def test_rate_limited_per_account(self):
+        outbox = Outbox(rate_per_hour=3600, burst=1)
+        self.queue(outbox, (1, u'a'), (1, u'b'), (2, u'c'))
+        self.assertEqual(outbox.drain(self.post, now=self.start), 2)
+        self.assertEqual(self.posted, [u'a', u'c'])
+        self.assertEqual(outbox.stats['throttled'], 1)
+        outbox.drain(self.post, now=self.start + 1)
+        self.assertEqual(self.posted, [u'a', u'c', u'b'])
+
+    def test_backoff(self):
+        outbox = Outbox(backoff=10, max_attempts=5)
+        self.queue(outbox, (1, u'a'), (1, u'b'), (2, u'c'))
+        self.failing.add(u'a')
+        outbox.drain(self.post, now=self.start)
+        #the account's later tweet waits behind the failed one
+        self.assertEqual(self.posted, [u'c'])
+        self.assertEqual(self.pending(),
+                         [(u'a', u'pending', 1), (u'b', u'pending', 0)])
+        outbox.drain(self.post, now=self.start + 5)
+        self.assertEqual(self.posted, [u'c'])
+        self.failing.clear()
+        outbox.drain(self.post, now=self.start + 10)
+        self.assertEqual(self.posted, [u'c', u'a', u'b'])
+
+    def test_dead_letter(self):
+        outbox = Outbox(backoff=1, backoff_cap=4, max_attempts=3)
+        self.queue(outbox, (1, u'a'), (1, u'b'))
+        self.failing.add(u'a')
+        for now in (0, 1, 3):
+            outbox.drain(self.post, now=self.start + now)
+        self.assertEqual(self.pending()[0], (u'a', u'dead', 3))
+        self.assertEqual(outbox.stats['dead'], 1)
+        #the dead tweet no longer holds the account up
+        outbox.drain(self.post, now=self.start + 100)
+        self.assertEqual(self.posted, [u'b'])
+        self.failing.clear()
+        with transaction.manager:
+            outbox.retry_dead()
+        outbox.drain(self.post)
+        self.assertEqual(self.posted, [u'b', u'a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
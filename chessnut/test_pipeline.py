@@ -0,0 +1,165 @@
+import threading
+import time
+import unittest
+
+from chessnut import dispatch, pipeline, render_cache, timing
+from chessnut.pipeline import Pipeline, Stage, Waiter
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_stages_in_order(self):
+        out = []
+        pipeline = Pipeline([
+            Stage('double', lambda x: [x * 2]),
+            Stage('collect', lambda x: out.append(x)),
+        ])
+        for i in xrange(5):
+            pipeline.put(i)
+        pipeline.join()
+        self.assertEqual(out, [0, 2, 4, 6, 8])
+        metrics = pipeline.metrics()
+        self.assertEqual([m['stage'] for m in metrics], ['double', 'collect'])
+        self.assertEqual(metrics[0]['in'], 5)
+        self.assertEqual(metrics[0]['out'], 5)
+        self.assertEqual(metrics[1]['depth'], 0)
+
+    def test_batch(self):
+        batches = []
+        release = threading.Event()
+
+        def hold(x):
+            release.wait()
+            return [x]
+        pipeline = Pipeline([
+            Stage('hold', hold, maxsize=10),
+            Stage('batch', lambda xs: batches.append(xs), batch=True),
+        ])
+        pipeline.put(0)
+        #the first item is held while the rest queue up behind it
+        time.sleep(0.05)
+        for i in xrange(1, 4):
+            pipeline.put(i)
+        release.set()
+        pipeline.join()
+        self.assertEqual(sum(batches, []), [0, 1, 2, 3])
+        self.assertTrue(len(batches) < 4)
+
+    def test_backpressure(self):
+        release = threading.Event()
+        pipeline = Pipeline([
+            Stage('slow', lambda x: release.wait() and None, maxsize=2),
+        ])
+        put = []
+
+        def feed():
+            for i in xrange(5):
+                pipeline.put(i)
+                put.append(i)
+        feeder = threading.Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+        time.sleep(0.1)
+        #one item being worked on and two queued
+        self.assertEqual(put, [0, 1, 2])
+        release.set()
+        feeder.join(5)
+        pipeline.join()
+        self.assertEqual(put, range(5))
+
+    def test_errors_counted(self):
+        def fail(x):
+            if x == 1:
+                raise ValueError(x)
+            return [x]
+        out = []
+        pipeline = Pipeline([Stage('fail', fail),
+                             Stage('collect', out.append)])
+        for i in xrange(3):
+            pipeline.put(i)
+        pipeline.join()
+        self.assertEqual(out, [0, 2])
+        self.assertEqual(pipeline.metrics()[0]['errors'], 1)
+
+    def test_workers(self):
+        running = []
+        lock = threading.Lock()
+
+        def work(x):
+            with lock:
+                running.append(x)
+            time.sleep(0.05)
+        pipeline = Pipeline([Stage('wide', work, workers=4)])
+        began = time.time()
+        for i in xrange(4):
+            pipeline.put(i)
+        pipeline.join()
+        self.assertEqual(sorted(running), range(4))
+        self.assertTrue(time.time() - began < 0.15)
+
+
+class Tweet(object):
+
+    def __init__(self, id):
+        self.id = id
+
+
+class FailingDispatcher(object):
+
+    def dispatch(self, tweets):
+        raise IOError('down')
+
+
+class TestWaiter(unittest.TestCase):
+
+    def test_waits_for_its_tweets(self):
+        tweets = [Tweet(1), Tweet(2)]
+        waiter = Waiter(tweets)
+        waiter.settle(1)
+        self.assertEqual(waiter.wait(0), set([2]))
+        settler = threading.Timer(0.05, waiter.settle, (2,))
+        settler.start()
+        self.assertEqual(waiter.wait(5), set())
+
+    def test_nothing_to_wait_for(self):
+        self.assertEqual(Waiter([]).wait(), set())
+
+    def test_settled_when_play_fails(self):
+        self.addCleanup(setattr, dispatch, 'dispatcher', dispatch.dispatcher)
+        dispatch.dispatcher = FailingDispatcher()
+        tweet = Tweet(1)
+        waiter = Waiter([tweet])
+        self.assertRaises(IOError, pipeline._play, [Tweet(2), tweet])
+        self.assertEqual(waiter.wait(0), set([1]))
+        self.assertEqual(waiter.unplayed(), set())
+        self.assertEqual(waiter.take_unplayed(), {1: 'failed'})
+        self.assertEqual(waiter.take_unplayed(), {})
+
+
+class FakeCache(object):
+
+    def __init__(self, boards):
+        self.boards = boards
+
+    def encoded(self, state):
+        return self.boards.get(state)
+
+    def put_encoded(self, state, data):
+        self.boards[state] = data
+
+
+class TestRender(unittest.TestCase):
+
+    def test_cached_board_marked_rendered(self):
+        for module, name, value in (
+                (render_cache, 'cache', FakeCache({u'a': 'data'})),
+                (timing, 'timings', timing.Timings())):
+            self.addCleanup(setattr, module, name, getattr(module, name))
+            setattr(module, name, value)
+        timing.timings.mark(5, 'fetched', 0)
+        pipeline._render((u'a', None, 5))
+        self.assertEqual(timing.timings.metrics().keys(), ['rendered'])
+
+
+if __name__ == '__main__':
+    unittest.main()
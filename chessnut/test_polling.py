@@ -0,0 +1,87 @@
+import unittest
+
+from chessnut.polling import PollSchedule, rate_limit
+
+
+class FakeResponse(object):
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+class FakeApi(object):
+
+    def __init__(self, headers):
+        self.last_response = FakeResponse(headers)
+
+
+class TestPollSchedule(unittest.TestCase):
+
+    def test_busy_shortens(self):
+        schedule = PollSchedule(10, 300, interval=80)
+        self.assertEqual(schedule.update(3), 40)
+        self.assertEqual(schedule.update(1), 20)
+        self.assertEqual(schedule.update(1), 10)
+        self.assertEqual(schedule.update(1), 10)
+
+    def test_idle_backs_off(self):
+        schedule = PollSchedule(10, 60)
+        self.assertEqual(schedule.update(0), 20)
+        self.assertEqual(schedule.update(0), 40)
+        self.assertEqual(schedule.update(0), 60)
+        self.assertEqual(schedule.update(0), 60)
+
+    def test_behind_polls_soon(self):
+        schedule = PollSchedule(10, 300, interval=80)
+        self.assertEqual(schedule.update(0, behind=True), 10)
+        self.assertEqual(schedule.update(0, 4, 15, 1200, now=1000,
+                                         behind=True), 50)
+        self.assertEqual(schedule.stats['busy_polls'], 2)
+
+    def test_spreads_quota(self):
+        schedule = PollSchedule(10, 300)
+        #4 calls left over 200 seconds
+        self.assertEqual(schedule.update(5, 4, 15, 1200, now=1000), 50)
+        self.assertEqual(schedule.stats['throttled_polls'], 1)
+
+    def test_exhausted_waits_for_reset(self):
+        schedule = PollSchedule(10, 300)
+        self.assertEqual(schedule.update(5, 0, 15, 1500, now=1000), 501)
+
+    def test_plenty_of_quota(self):
+        schedule = PollSchedule(10, 300, interval=20)
+        self.assertEqual(schedule.update(5, 180, 180, 1900, now=1000), 10)
+
+    def test_metrics(self):
+        schedule = PollSchedule(10, 300)
+        schedule.update(0, 45, 180, 1600, now=1000)
+        metrics = schedule.metrics(now=1100)
+        self.assertEqual(metrics['interval'], 20)
+        self.assertEqual(metrics['headroom'], 0.25)
+        self.assertEqual(metrics['reset_in'], 500)
+        self.assertEqual(metrics['polls'], 1)
+
+    def test_metrics_before_poll(self):
+        metrics = PollSchedule().metrics()
+        self.assertEqual(metrics['headroom'], None)
+        self.assertEqual(metrics['reset_in'], None)
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def test_headers(self):
+        api = FakeApi({'x-rate-limit-remaining': '14',
+                       'x-rate-limit-limit': '15',
+                       'x-rate-limit-reset': '1400000000'})
+        self.assertEqual(rate_limit(api), (14, 15, 1400000000))
+
+    def test_missing(self):
+        self.assertEqual(rate_limit(FakeApi({})), (None, None, None))
+        self.assertEqual(rate_limit(object()), (None, None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import transaction
+from sqlalchemy import create_engine, event
+
+from chessnut.models import Base, Challenge, DBSession, Game, TwUser
+from chessnut.prefetch import Batch
+from chessnut.twitter import parse
+
+
+class User(object):
+
+    def __init__(self, id):
+        self.id = id
+
+
+class Tweet(object):
+
+    def __init__(self, user_id, text):
+        self.user = User(user_id)
+        self.text = text
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        DBSession.configure(bind=engine)
+        Base.metadata.create_all(engine)
+        self.statements = []
+        event.listen(engine, 'before_cursor_execute',
+                     lambda *args: self.statements.append(args[2]))
+        with transaction.manager:
+            for i in xrange(1, 5):
+                DBSession.add(TwUser(u'k%s' % i, u's%s' % i, 100 + i))
+            for i, name in ((1, u'one'), (3, u'two')):
+                challenge = Challenge(name, i, u'someone', u'owner')
+                challenge.opponent_id = i + 1
+                DBSession.add(challenge)
+                DBSession.flush()
+                DBSession.add(Game(challenge))
+            DBSession.add(Challenge(u'open', 1, u'bob', u'owner'))
+        transaction.begin()
+        del self.statements[:]
+
+    def tearDown(self):
+        transaction.abort()
+        DBSession.remove()
+
+    def test_one_query_per_table(self):
+        tweets = [Tweet(101, u'@ChessnutApp #one e4'),
+                  Tweet(102, u'@ChessnutApp #one e5'),
+                  Tweet(103, u'@ChessnutApp #two d4'),
+                  Tweet(109, u'@ChessnutApp @bob #open'),
+                  Tweet(101, u'not a command')]
+        batch = Batch.load(tweets, parse)
+        #users by twitter id, games, challenges, then the players of the
+        #games who didn't tweet
+        self.assertEqual(len(self.statements), 4)
+        del self.statements[:]
+        self.assertEqual(batch.user_by_user_id(101).id, 1)
+        self.assertEqual(batch.game(u'two').owner, 3)
+        self.assertEqual(batch.user(4).user_id, 104)
+        self.assertEqual(batch.challenge(u'open').opponent, u'bob')
+        self.assertEqual(self.statements, [])
+
+    def test_misses_fall_through(self):
+        batch = Batch.load([Tweet(101, u'@ChessnutApp @bob #fresh')], parse)
+        self.assertEqual(batch.challenge(u'fresh'), None)
+        DBSession.add(Challenge(u'fresh', 1, u'bob', u'owner'))
+        self.assertEqual(batch.challenge(u'fresh').name, u'fresh')
+        self.assertEqual(batch.stats['hits'], 0)
+        batch.challenge(u'fresh')
+        self.assertEqual(batch.stats['hits'], 1)
+
+    def test_attached_rows_saved(self):
+        batch = Batch.load([Tweet(101, u'@ChessnutApp #one e4')], parse)
+        #committing closes the session, detaching the batch's rows
+        transaction.commit()
+        with transaction.manager:
+            batch.attach()
+            batch.game(u'one').pgn = u'1. e4'
+        self.assertEqual(Game.get_by_name(u'one').pgn, u'1. e4')
+
+    def test_empty(self):
+        Batch.load([], parse)
+        self.assertEqual(self.statements, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
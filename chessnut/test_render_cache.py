@@ -0,0 +1,177 @@
+import os
+import shutil
+import tempfile
+import unittest
+from PIL import Image
+from chessnut.render_cache import (
+    BoardCache,
+    cache_from_settings,
+    relative_path,
+    )
+from chessnut.scripts.migrateboards import migrate
+
+
+start = 'rnbqkbnrpppppppp00000000000000000000000000000000PPPPPPPPRNBQKBNR'
+
+
+class TestBoardCache(unittest.TestCase):
+    """Test the bounded board cache."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image = Image.new('RGBA', (8, 8), (255, 0, 0, 255))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_miss_then_hit(self):
+        cache = BoardCache(self.directory, memory_entries=0)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', self.image)
+        self.assertTrue(os.path.isfile(cache.path('a')))
+        self.assertEqual(cache.get('a').size, (8, 8))
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['memory_hits'], 0)
+
+    def test_memory_hit(self):
+        cache = BoardCache(self.directory, memory_entries=1)
+        cache.put('a', self.image)
+        self.assertIs(cache.get('a'), self.image)
+        self.assertEqual(cache.stats['memory_hits'], 1)
+
+    def test_no_temp_files_left(self):
+        cache = BoardCache(self.directory)
+        cache.put('a', self.image)
+        shard, name = os.path.split(cache.path('a'))
+        self.assertEqual(os.listdir(shard), [name])
+
+    def test_lru_eviction(self):
+        cache = BoardCache(self.directory, max_entries=2, memory_entries=0)
+        cache.put('a', self.image)
+        cache.put('b', self.image)
+        cache.get('a')
+        cache.put('c', self.image)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertFalse(os.path.isfile(cache.path('b')))
+        self.assertEqual(cache.stats['evictions'], 1)
+
+    def test_lfu_eviction(self):
+        cache = BoardCache(self.directory, max_entries=2, eviction='lfu',
+                           memory_entries=0)
+        cache.put('a', self.image)
+        cache.put('b', self.image)
+        cache.get('a')
+        cache.get('b')
+        cache.get('b')
+        cache.put('c', self.image)
+        self.assertNotIn('a', cache)
+        self.assertIn('b', cache)
+
+    def test_bulk_eviction(self):
+        for eviction in ('lru', 'lfu'):
+            cache = BoardCache(self.directory, max_entries=None,
+                               eviction=eviction)
+            cache._load_index()
+            for i in xrange(2000):
+                key = '%016x' % i
+                cache._index[key] = 1
+                cache._touch(key)
+                if i % 2:
+                    cache._touch(key)
+            cache.max_entries = 100
+            cache._evict()
+            self.assertEqual(cache.stats['evictions'], 1900)
+            if eviction == 'lru':
+                expected = range(1900, 2000)
+            else:
+                expected = range(1801, 2000, 2)
+            self.assertEqual(sorted(cache._index),
+                             ['%016x' % i for i in expected])
+
+    def test_byte_budget(self):
+        cache = BoardCache(self.directory, max_entries=None, max_bytes=1)
+        cache.put('a', self.image)
+        self.assertNotIn('a', cache)
+        self.assertFalse(os.path.isfile(cache.path('a')))
+
+    def test_existing_files_indexed(self):
+        BoardCache(self.directory).put('a', self.image)
+        cache = BoardCache(self.directory)
+        self.assertIn('a', cache)
+
+    def test_sharded_layout(self):
+        path = relative_path(start)
+        key = os.path.splitext(os.path.basename(path))[0]
+        self.assertEqual(len(key), 16)
+        self.assertEqual(path, os.path.join(key[:2], key[2:4], key + '.png'))
+        self.assertNotIn(start, path)
+
+    def test_migrate_flat_boards(self):
+        self.image.save(os.path.join(self.directory, start + '.png'))
+        self.image.save(os.path.join(self.directory, 'notes.png'))
+        cache = BoardCache(self.directory)
+        self.assertEqual(migrate(cache, self.directory), 1)
+        self.assertIn(start, cache)
+        self.assertTrue(os.path.isfile(cache.path(start)))
+        self.assertFalse(
+            os.path.isfile(os.path.join(self.directory, start + '.png')))
+
+    def test_migrate_within_budget(self):
+        for name in (start, start.lower()):
+            self.image.save(os.path.join(self.directory, name + '.png'))
+        cache = BoardCache(self.directory, max_entries=1)
+        self.assertEqual(migrate(cache, self.directory), 2)
+        self.assertEqual(len([state for state in (start, start.lower())
+                              if state in cache]), 1)
+        self.assertEqual(cache.stats['evictions'], 1)
+
+    def test_formats(self):
+        for fmt, extension in [('png8', '.png'), ('jpeg', '.jpg')]:
+            cache = BoardCache(self.directory, format=fmt, memory_entries=0)
+            cache.put(start, self.image)
+            self.assertTrue(cache.path(start).endswith(extension))
+            self.assertEqual(cache.get(start).mode, 'RGBA')
+            self.assertEqual(cache.stats['encoded_bytes'],
+                             os.path.getsize(cache.path(start)))
+        self.assertRaises(ValueError, BoardCache, self.directory,
+                          format='bmp')
+
+    def test_persist_off(self):
+        cache = BoardCache(self.directory, persist='off')
+        data = cache.put('a', self.image)
+        self.assertEqual(cache.encoded('a'), data)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_persist_behind(self):
+        cache = BoardCache(self.directory, persist='behind')
+        data = cache.put('a', self.image)
+        cache.flush()
+        with open(cache.path('a'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_encoded_from_disk(self):
+        data = BoardCache(self.directory).put('a', self.image)
+        cache = BoardCache(self.directory)
+        self.assertEqual(cache.encoded('a'), data)
+        self.assertEqual(cache.get('a').size, (8, 8))
+
+    def test_put_encoded(self):
+        data = BoardCache(self.directory, persist='off').put('a', self.image)
+        cache = BoardCache(self.directory, memory_entries=0)
+        self.assertEqual(cache.put_encoded('a', data), data)
+        self.assertEqual(cache.get('a').size, (8, 8))
+        with open(cache.path('a'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_from_settings(self):
+        cache = cache_from_settings({'boards.directory': self.directory,
+                                     'boards.max_bytes': '',
+                                     'boards.eviction': 'lfu'})
+        self.assertEqual(cache.directory, self.directory)
+        self.assertIsNone(cache.max_bytes)
+        self.assertEqual(cache.eviction, 'lfu')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from PIL import Image
+from chessnut import render_cache
+from chessnut.chess import positions
+from chessnut.encoding import quantize
+from chessnut.generate_board import _full, start
+from chessnut.replay import encode_gif, frames, lzw, replay, TRANSPARENT
+
+
+class FakeGame(object):
+    def __init__(self, game_id, pgn):
+        self.game_id = game_id
+        self.pgn = pgn
+
+
+class TestReplay(unittest.TestCase):
+    """Test animated game replays."""
+    def setUp(self):
+        self.pgn = '1. e4 e5 2. Nf3 Nc6 3. Bc4 Nf6 4. O-O Nxe4'
+
+    def test_lzw_round_trip(self):
+        data = ''.join(chr(i % 7) * (i % 13 + 1) for i in xrange(3000))
+        data += ''.join(chr((i * 7919) % 256) for i in xrange(20000))
+        data = data[:200 * 100]
+        stream = lzw(data)
+        blocks = ''.join(chr(len(stream[i:i + 255])) + stream[i:i + 255]
+                         for i in xrange(0, len(stream), 255))
+        gif = ('GIF89a\xc8\x00d\x00\xf7\x00\x00' + '\x00' * 768 +
+               ',\x00\x00\x00\x00\xc8\x00d\x00\x00\x08' + blocks +
+               '\x00;')
+        self.assertEqual(Image.open(BytesIO(gif)).tobytes(), data)
+
+    def test_frames_rebuild_every_position(self):
+        canvas = None
+        states = [start] + list(positions(self.pgn))
+        for (image, (x, y)), state in zip(frames(self.pgn), states):
+            if canvas is None:
+                canvas = image.copy()
+            else:
+                w, h = image.size
+                region = canvas.crop((x, y, x + w, y + h))
+                mask = image.point(
+                    lambda i: 0 if i == TRANSPARENT else 255, '1')
+                region.paste(image, (0, 0), mask)
+                canvas.paste(region, (x, y))
+            self.assertEqual(canvas.tobytes(),
+                             quantize(_full(state)).tobytes())
+
+    def test_encode_gif(self):
+        f = BytesIO()
+        encode_gif(self.pgn, f)
+        image = Image.open(BytesIO(f.getvalue()))
+        self.assertEqual(image.format, 'GIF')
+        self.assertEqual(image.size, (500, 500))
+
+    def test_replay_cached_by_game_and_ply(self):
+        cache, directory = render_cache.cache, tempfile.mkdtemp()
+        render_cache.cache = render_cache.BoardCache(directory)
+        try:
+            game = FakeGame(3, u'1. e4 e5')
+            path = replay(game)
+            self.assertTrue(path.endswith('3-2.gif'))
+            mtime = os.path.getmtime(path)
+            self.assertEqual(replay(game), path)
+            self.assertEqual(os.path.getmtime(path), mtime)
+            game.pgn = u'1. e4 e5 2. Nf3'
+            self.assertTrue(replay(game).endswith('3-3.gif'))
+            self.assertFalse(os.path.exists(path))
+        finally:
+            render_cache.cache = cache
+            shutil.rmtree(directory)
+
+    def test_replays_count_against_budget(self):
+        cache, directory = render_cache.cache, tempfile.mkdtemp()
+        render_cache.cache = render_cache.BoardCache(directory, max_entries=1)
+        try:
+            first = replay(FakeGame(3, u'1. e4 e5'))
+            second = replay(FakeGame(4, u'1. d4'))
+            self.assertFalse(os.path.exists(first))
+            self.assertTrue(os.path.exists(second))
+            render_cache.cache = render_cache.BoardCache(directory)
+            self.assertTrue(render_cache.cache.use_file(
+                os.path.relpath(second, directory)))
+        finally:
+            render_cache.cache = cache
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
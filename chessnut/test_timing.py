@@ -0,0 +1,108 @@
+import json
+import logging
+import unittest
+from datetime import datetime
+
+from chessnut.timing import Histogram, Timings, log
+
+
+class Tweet(object):
+
+    def __init__(self, id, created_at=None):
+        self.id = id
+        self.created_at = created_at
+
+
+class Records(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(json.loads(record.getMessage()))
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        for i in xrange(1, 101):
+            histogram.add(i)
+        metrics = histogram.metrics()
+        self.assertEqual((metrics['p50'], metrics['p95'], metrics['p99']),
+                         (51, 96, 100))
+        self.assertEqual((metrics['count'], metrics['mean'], metrics['max']),
+                         (100, 50.5, 100))
+
+    def test_keeps_last_samples(self):
+        histogram = Histogram(samples=10)
+        for i in xrange(100):
+            histogram.add(i)
+        self.assertEqual(histogram.metrics()['p50'], 95)
+        self.assertEqual(histogram.count, 100)
+
+    def test_empty(self):
+        self.assertEqual(Histogram().metrics()['p99'], None)
+
+
+class TestTimings(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = Records()
+        log.addHandler(self.handler)
+        self.addCleanup(log.removeHandler, self.handler)
+        self.level = log.level
+        log.setLevel(logging.INFO)
+        self.addCleanup(log.setLevel, self.level)
+
+    def test_steps_timed_from_the_one_before(self):
+        timings = Timings()
+        created = datetime(2014, 3, 1, 12, 0, 0)
+        start = 1393675200
+        timings.received(Tweet(5, created), at=start + 60)
+        for step, at in (('parsed', 61), ('loaded', 63), ('played', 64),
+                         ('queued', 64), ('rendered', 90), ('posted', 92)):
+            timings.mark(5, step, start + at)
+        metrics = timings.metrics()
+        self.assertEqual(metrics.keys(), ['fetched', 'parsed', 'loaded',
+                                          'played', 'queued', 'rendered',
+                                          'posted', 'total'])
+        self.assertEqual(metrics['fetched']['p50'], 60)
+        self.assertEqual(metrics['rendered']['p50'], 26)
+        self.assertEqual(metrics['total']['max'], 92)
+        [record] = self.handler.records
+        self.assertEqual(record['tweet_id'], 5)
+        self.assertEqual(record['total'], 92)
+        self.assertEqual(record['steps'][0], ['created', 0])
+        self.assertEqual(record['steps'][-1], ['posted', 92])
+
+    def test_posted_ends_trace(self):
+        timings = Timings()
+        timings.mark(5, 'fetched', 10)
+        timings.mark(5, 'posted', 12)
+        timings.mark(5, 'posted', 20)
+        self.assertEqual(timings.metrics()['posted']['count'], 1)
+        self.assertEqual(len(self.handler.records), 1)
+
+    def test_untraced_and_missing(self):
+        timings = Timings()
+        timings.mark(None, 'parsed')
+        timings.mark(7, 'posted')
+        #a mention that was fetched again but not queued
+        timings.mark(8, 'parsed')
+        timings.mark(8, 'queued')
+        self.assertEqual(timings.metrics(), {})
+        self.assertEqual(self.handler.records, [])
+
+    def test_oldest_trace_dropped(self):
+        timings = Timings(traces=2)
+        for i in xrange(3):
+            timings.mark(i, 'fetched', 0)
+        timings.mark(0, 'posted', 5)
+        timings.mark(2, 'posted', 5)
+        self.assertEqual([r['tweet_id'] for r in self.handler.records], [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+import transaction
+from Queue import Queue
+from sqlalchemy import create_engine
+
+from chessnut import twitter
+from chessnut.models import Base, DBSession, ProcessedTweet
+from chessnut.twitter import fetch_mentions
+
+
+class Tweet(object):
+
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeTimeline(object):
+    """mentions_timeline over a fixed set of tweet ids, newest first."""
+
+    def __init__(self, ids):
+        self.ids = sorted(ids, reverse=True)
+        self.calls = []
+
+    def mentions_timeline(self, since_id=None, max_id=None, count=20):
+        self.calls.append((since_id, max_id))
+        return [Tweet(i) for i in self.ids
+                if (since_id is None or i > since_id) and
+                (max_id is None or i <= max_id)][:count]
+
+
+def drain(movequeue):
+    return [movequeue.get().id for i in xrange(movequeue.qsize())]
+
+
+class TestFetchMentions(unittest.TestCase):
+
+    def test_single_page(self):
+        api, movequeue = FakeTimeline(range(1, 8)), Queue()
+        self.assertEqual(fetch_mentions(api, 3, movequeue, count=10), 7)
+        self.assertEqual(drain(movequeue), [4, 5, 6, 7])
+        self.assertEqual(api.calls, [(3, None)])
+
+    def test_pages_back_to_since_id(self):
+        api, movequeue = FakeTimeline(range(1, 26)), Queue()
+        self.assertEqual(fetch_mentions(api, 2, movequeue, count=10), 25)
+        self.assertEqual(drain(movequeue), range(3, 26))
+        self.assertEqual(api.calls, [(2, None), (2, 15), (2, 5)])
+
+    def test_short_page_not_last(self):
+        api, movequeue = FakeTimeline(range(1, 26)), Queue()
+        timeline = api.mentions_timeline
+        #a page cut short, as twitter does once it has filtered it
+        api.mentions_timeline = lambda **kwargs: timeline(**kwargs)[:4]
+        self.assertEqual(fetch_mentions(api, 10, movequeue, count=10), 25)
+        self.assertEqual(drain(movequeue), range(11, 26))
+
+    def test_nothing_new(self):
+        api, movequeue = FakeTimeline(range(1, 5)), Queue()
+        self.assertEqual(fetch_mentions(api, 4, movequeue), 4)
+        self.assertEqual(drain(movequeue), [])
+
+    def test_budget_resumes(self):
+        api, movequeue, held = FakeTimeline(range(1, 36)), Queue(), {}
+        self.assertEqual(fetch_mentions(api, 0, movequeue, budget=2,
+                                        count=10, held=held), 0)
+        self.assertEqual(drain(movequeue), [])
+        #new mentions arrive before the next poll
+        api.ids = range(40, 0, -1)
+        self.assertEqual(fetch_mentions(api, 0, movequeue, budget=3,
+                                        count=10, held=held), 35)
+        self.assertEqual(drain(movequeue), range(1, 36))
+        self.assertEqual(api.calls, [(0, None), (0, 25), (0, 15), (0, 5)])
+        self.assertEqual(held, {})
+        #the newer ones are read by the poll after
+        self.assertEqual(fetch_mentions(api, 35, movequeue, budget=3,
+                                        count=10, held=held), 40)
+        self.assertEqual(drain(movequeue), range(36, 41))
+
+    def test_held_pages_dropped_for_other_since_id(self):
+        api, movequeue, held = FakeTimeline(range(1, 41)), Queue(), {}
+        fetch_mentions(api, 0, movequeue, budget=1, count=10, held=held)
+        self.assertEqual(fetch_mentions(api, 30, movequeue, count=10,
+                                        held=held), 40)
+        self.assertEqual(drain(movequeue), range(31, 41))
+        self.assertEqual(held, {})
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        DBSession.configure(bind=engine)
+        Base.metadata.create_all(engine)
+        self.played = []
+        self.addCleanup(setattr, twitter, '_play', twitter._play)
+        twitter._play = lambda move, batch: self.played.append(move.id)
+
+    def tearDown(self):
+        DBSession.remove()
+
+    def test_played_once(self):
+        for i in xrange(2):
+            with transaction.manager:
+                twitter.play(Tweet(5))
+        self.assertEqual(self.played, [5])
+
+    def test_rolled_back_replayed(self):
+        transaction.begin()
+        twitter.play(Tweet(5))
+        transaction.abort()
+        with transaction.manager:
+            twitter.play(Tweet(5))
+        self.assertEqual(self.played, [5, 5])
+
+    def test_processed_ids_and_prune(self):
+        with transaction.manager:
+            for i in (3, 5, 8):
+                twitter.play(Tweet(i))
+        with transaction.manager:
+            self.assertEqual(ProcessedTweet.processed_ids([1, 3, 8, 9]),
+                             set([3, 8]))
+            self.assertEqual(ProcessedTweet.processed_ids([]), set())
+            ProcessedTweet.prune(5)
+        with transaction.manager:
+            self.assertEqual(ProcessedTweet.processed_ids([3, 5, 8]),
+                             set([8]))
+
+
+if __name__ == '__main__':
+    unittest.main()
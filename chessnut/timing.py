@@ -0,0 +1,143 @@
+"""Where the time between a player's tweet and the bot's reply goes.
+
+Each mention is traced through the steps below, in roughly this order:
+
+    created    the tweet's created_at
+    fetched    read from the timeline or the stream
+    parsed     parsed as a command
+    loaded     its user and game looked up
+    played     the move checked and applied by the engine
+    queued     its reply added to the outbox
+    rendered   the reply's board rendered by the pipeline's render stage
+    uploaded   the board uploaded, unless the account had uploaded it before
+    posted     the reply posted
+
+A step is timed from whichever step the mention reached before it, so the
+time it spent waiting for a poll, a pipeline stage or the outbox is part of
+the step that follows the wait. Every step's times go into a histogram, as
+does the total from created to posted, and a finished trace is logged as
+one JSON line to the chessnut.timing logger.
+"""
+import calendar
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+log = logging.getLogger(__name__)
+
+STEPS = ('created', 'fetched', 'parsed', 'loaded', 'played', 'queued',
+         'rendered', 'uploaded', 'posted')
+
+
+class Histogram(object):
+    """Percentiles of the last samples values recorded."""
+
+    def __init__(self, samples=1000):
+        self.count = 0
+        self.total = 0.0
+        self._values = deque(maxlen=samples)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self._values.append(value)
+
+    def percentile(self, fraction):
+        values = sorted(self._values)
+        if not values:
+            return None
+        return values[min(int(len(values) * fraction), len(values) - 1)]
+
+    def metrics(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': max(self._values) if self._values else None,
+        }
+
+
+class Timings(object):
+    """Traces of up to traces mentions in flight, and histograms of the
+    steps they've been through. A trace is dropped once its reply is
+    posted, or when it's the oldest and room is needed for a new one.
+    """
+
+    def __init__(self, samples=1000, traces=10000):
+        self.samples = samples
+        self.traces = traces
+        self.histograms = {}
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark(self, tweet_id, step, at=None):
+        """Records that mention tweet_id reached step at epoch second at,
+        now by default.
+        """
+        if tweet_id is None:
+            return
+        if at is None:
+            at = time.time()
+        with self._lock:
+            trace = self._traces.get(tweet_id)
+            if trace is None:
+                #only received starts a trace; anything else was traced
+                #before a restart, already posted or never queued
+                if step not in ('created', 'fetched'):
+                    return
+                trace = self._traces[tweet_id] = []
+                while len(self._traces) > self.traces:
+                    self._traces.popitem(last=False)
+            if trace:
+                self._histogram(step).add(max(at - trace[-1][1], 0))
+            trace.append((step, at))
+            if step != 'posted':
+                return
+            del self._traces[tweet_id]
+            total = at - trace[0][1]
+            self._histogram('total').add(total)
+        log.info(json.dumps({
+            'tweet_id': tweet_id,
+            'total': round(total, 3),
+            'steps': [(s, round(t - trace[0][1], 3)) for s, t in trace],
+        }))
+
+    def received(self, tweet, at=None):
+        """Starts the trace of a mention as it's queued to be played, from
+        its created_at if it has one. Mentions that are fetched again but
+        already queued or played aren't received, so they start no trace.
+        """
+        created = getattr(tweet, 'created_at', None)
+        if created is not None and tweet.id not in self._traces:
+            self.mark(tweet.id, 'created', calendar.timegm(
+                created.utctimetuple()))
+        self.mark(tweet.id, 'fetched', at)
+
+    def _histogram(self, step):
+        if step not in self.histograms:
+            self.histograms[step] = Histogram(self.samples)
+        return self.histograms[step]
+
+    def metrics(self):
+        """Returns the percentiles of every step's times, in seconds."""
+        with self._lock:
+            steps = [s for s in STEPS + ('total',) if s in self.histograms]
+            return OrderedDict((s, self.histograms[s].metrics())
+                               for s in steps)
+
+
+timings = Timings()
+
+
+def configure(settings):
+    """Replaces the shared timings with one keeping timing.samples times
+    per step.
+    """
+    global timings
+    timings = Timings(int(settings.get('timing.samples') or 1000))
+    return timings
@@ -1,18 +1,47 @@
 from .models import (
     DBSession,
     TwUser,
-    Game,
     Challenge,
+    ProcessedTweet,
     )
-from .generate_board import board
+from .generate_board import board, start
+from . import error_replies, identities, media, outbox, render_cache, timing
 from .chess import ChessnutGame as cg
-from gevent.queue import Queue as gqueue
+from .clients import BOT, ClientRegistry
+from .prefetch import Batch
+from .polling import rate_limit
+from Queue import Queue
+from tweepy.binder import bind_api
+import mimetypes
 import tweepy
 import re
+import threading
+import transaction
 
 
 consumer_key = ''
 consumer_secret = ''
+#most mentions_timeline pages a poll reads
+page_budget = 5
+#where the REST and OAuth endpoints are, so a stand-in can replace them
+api_host = 'api.twitter.com'
+api_root = '/1.1'
+api_secure = True
+upload_host = 'upload.twitter.com'
+#error code for a media id Twitter no longer has, or never gave the account
+MEDIA_GONE = 324
+
+
+def configure(settings):
+    global page_budget, api_host, api_root, api_secure, upload_host
+    page_budget = int(settings.get('twitter.poll_pages') or 5)
+    api_host = settings.get('twitter.api_host') or 'api.twitter.com'
+    api_root = settings.get('twitter.api_root') or '/1.1'
+    api_secure = (settings.get('twitter.api_secure') or
+                  'true').lower() == 'true'
+    upload_host = settings.get('twitter.upload_host') or 'upload.twitter.com'
+    #clients built before were pointed at the old host
+    clients.invalidate()
 
 
 def tweet_parser(tweet):
@@ -36,144 +65,410 @@ def tweet_parser(tweet):
         raise ValueError("Tweet not formatted correctly.")
 
 
-def get_api(user):
-    key, secret = user.key, user.secret
-    auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
+class OAuthHandler(tweepy.OAuthHandler):
+    """tweepy's OAuthHandler, talking to api_host rather than always to
+    api.twitter.com over https.
+    """
+
+    def set_access_token(self, key, secret):
+        #tokens come back from the database as unicode, which can't sign
+        tweepy.OAuthHandler.set_access_token(self, bytes(key), bytes(secret))
+
+    def _get_oauth_url(self, endpoint, secure=True):
+        return '%s://%s%s%s' % ('https' if api_secure else 'http', api_host,
+                                self.OAUTH_ROOT, endpoint)
+
+    def get_username(self):
+        if self.username is None:
+            self.username = new_api(self).verify_credentials().screen_name
+        return self.username
+
+
+class API(tweepy.API):
+    """tweepy's API, keeping last_response per thread. Clients are shared
+    between the poll, the stream and the outbox, so each thread reads the
+    response to its own last call rather than whichever came back last.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._local = threading.local()
+        tweepy.API.__init__(self, *args, **kwargs)
+
+    @property
+    def last_response(self):
+        return getattr(self._local, 'response', None)
+
+    @last_response.setter
+    def last_response(self, resp):
+        self._local.response = resp
+
+
+def new_api(auth):
+    """Returns an API for auth on api_host."""
+    return API(auth, host=api_host, api_root=api_root,
+                      secure=api_secure)
+
+
+def _build_api(key, secret):
+    auth = OAuthHandler(consumer_key, consumer_secret)
     auth.set_access_token(key, secret)
-    api = tweepy.API(auth)
+    api = new_api(auth)
     return api
 
 
+clients = ClientRegistry(_build_api)
+
+
+def get_api(user):
+    return clients.get(user)
+
+
 def cn_api():
-    user = TwUser.get_by_id(1)
-    key, secret = user.key, user.secret
-    auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
-    auth.set_access_token(key, secret)
-    api = tweepy.API(auth)
-    return api
+    return clients.bot(TwUser.get_by_id)
 
 
-def get_moves(since_id):
+def fetch_mentions(api, since_id, movequeue, budget=None, count=200,
+                   held=None):
+    """Pages backwards through the mentions newer than since_id with max_id
+    and, once it has read back to since_id, puts them all into movequeue,
+    oldest first. Only an empty page ends the walk; short pages come back
+    while there are more to read. Makes at most budget calls. If they run
+    out first, nothing is queued and the pages read so far are kept in held
+    for the next poll to carry on from, so no mention is queued before an
+    older one. Returns the newest id queued, or since_id.
+    """
+    if held is None:
+        held = {}
+    #a walk is only carried on from the since_id it started at
+    pages = held.pop(since_id, [])
+    held.clear()
+    max_id = pages[-1][-1].id - 1 if pages else None
+    calls = 0
+    while since_id is None or max_id is None or max_id > since_id:
+        if budget is not None and calls >= budget:
+            held[since_id] = pages
+            return since_id
+        kwargs = {'since_id': since_id, 'count': count}
+        if max_id is not None:
+            kwargs['max_id'] = max_id
+        page = [i for i in api.mentions_timeline(**kwargs)
+                if since_id is None or i.id > since_id]
+        calls += 1
+        if not page:
+            break
+        pages.append(page)
+        max_id = page[-1].id - 1
+    for page in reversed(pages):
+        for i in reversed(page):
+            movequeue.put(i)
+    return pages[0][0].id if pages else since_id
+
+
+#pages of a walk through the mentions that ran out of budget, by the
+#since_id it started at (see fetch_mentions); a restart reads them again
+_held = {}
+
+
+def get_moves(since_id, budget=None):
+    """Returns the newest mention id read, a queue of mentions since
+    since_id, the (remaining, limit, reset) rate limit of the timeline and
+    whether the walk was held for the next poll to carry on. budget caps
+    the pages read; see fetch_mentions.
+    """
+    if budget is None:
+        budget = page_budget
     api = cn_api()
-    mentions = api.mentions_timeline(since_id=since_id.value)
-    movequeue = gqueue()
-    for i in mentions[-1::-1]:
-        movequeue.put(i)
-        since_id.value = i.id
-    return since_id.value, movequeue
-
-
-def execute_moves(movequeue):
-    size = movequeue.qsize()
-    for i in xrange(size):
-        move = movequeue.get()
-        text, user_id, user = move.text, move.user.id, move.user.screen_name
-        parsed = tweet_parser(text)
-        current_twuser = TwUser.get_by_user_id(user_id)
-        #assume it's a move and give it a shot
+    movequeue = Queue()
+    value = fetch_mentions(api, since_id.value, movequeue, budget, held=_held)
+    return value, movequeue, rate_limit(api), bool(_held)
+
+
+def parse(tweet):
+    """Returns the fields tweet_parser finds in tweet, or None if it isn't
+    formatted as a command. The result is kept on the tweet.
+    """
+    if not hasattr(tweet, 'parsed'):
         try:
-            game = Game.get_by_name(parsed['game'])
-            if game.is_turn(current_twuser.id):
-                game_update = cg(game.pgn)
-                game_update(parsed['move'].encode())
-                game.pgn = game_update.pgn
-                board(game_update.image_string)
-                image = generate_filepath(game_update.image_string)
-                send_user_tweet(current_twuser, image, game)
-                game.end_turn()
-            else:
-                send_error(user_id, 'notyourturn')
-        except:
-            #this means it should be a challenge
-            if parsed['opponent'] and parsed['game']:
-                challenge = Challenge.get_by_name(parsed['game'])
-                opponent = current_twuser
-                if challenge is not None and opponent is not None:
-                    if challenge.owner_sn == parsed['opponent'] and challenge.opponent == user:
-                        challenge.accept(opponent.id)
-                        send_game_start(parsed['game'], parsed['opponent'], user)
-                    else:
-                        send_error(user_id, error='notyourgame')
-                elif challenge is not None:
-                    send_error(user_id, error='register')
+            tweet.parsed = tweet_parser(tweet.text)
+        except ValueError:
+            tweet.parsed = None
+        timing.timings.mark(getattr(tweet, 'id', None), 'parsed')
+    return tweet.parsed
+
+
+def play(move, batch=None):
+    """Handles one mention: a move, a challenge or an acceptance, and
+    journals it so it's never handled twice. Rows are looked up in batch,
+    a prefetch.Batch, if given. Returns the (image string, previous image
+    string) if a move was played.
+    """
+    if ProcessedTweet.seen(move.id):
+        return None
+    DBSession.add(ProcessedTweet(move.id))
+    return _play(move, batch if batch is not None else Batch())
+
+
+def _play(move, batch):
+    text, user_id, user = move.text, move.user.id, move.user.screen_name
+    parsed = parse(move)
+    if parsed is None:
+        send_error(user_id, error='format')
+        return None
+    current_twuser = batch.user_by_user_id(user_id)
+    identities.cache.observe(move, current_twuser)
+    #assume it's a move and give it a shot
+    try:
+        game = batch.game(parsed['game'])
+        timing.timings.mark(move.id, 'loaded')
+        if game.is_turn(current_twuser.id):
+            game_update = cg(game.pgn)
+            previous = game_update.image_string or start
+            game_update(parsed['move'].encode())
+            timing.timings.mark(move.id, 'played')
+            game.pgn = game_update.pgn
+            send_user_tweet(current_twuser, game,
+                            game_update.image_string, previous, batch=batch,
+                            mention_id=move.id)
+            game.end_turn()
+            return game_update.image_string, previous
+        else:
+            send_error(user_id, 'notyourturn')
+    except:
+        #this means it should be a challenge
+        if parsed['opponent'] and parsed['game']:
+            challenge = batch.challenge(parsed['game'])
+            opponent = current_twuser
+            if challenge is not None and opponent is not None:
+                if challenge.owner_sn == parsed['opponent'] and challenge.opponent == user:
+                    challenge.accept(opponent.id)
+                    send_game_start(parsed['game'], parsed['opponent'], user,
+                                    move.id)
                 else:
-                    #making sure user_id is registered with us
-                    owner = current_twuser
-                    try:
-                        challenge = Challenge(parsed['game'],
-                                              owner.id,
-                                              parsed['opponent'],
-                                              user,
-                                              )
-                        DBSession.add(challenge)
-                        send_challenge(user_id, parsed['opponent'])
-                    #this is for the unregistered
-                    except AttributeError:
-                        send_error(user_id, error='register')
-                    #should be preventing duplicate game names here
-                    except:
-                        send_error(user_id, error='gamename')
-            #formatting problems get grabbed here
+                    send_error(user_id, error='notyourgame')
+            elif challenge is not None:
+                send_error(user_id, error='register')
             else:
-                send_error(user_id, error='format')
-        #and this is just us handling a normal move
+                #making sure user_id is registered with us
+                owner = current_twuser
+                try:
+                    challenge = Challenge(parsed['game'],
+                                          owner.id,
+                                          parsed['opponent'],
+                                          user,
+                                          )
+                    DBSession.add(challenge)
+                    send_challenge(user_id, parsed['opponent'], batch,
+                                   move.id)
+                #this is for the unregistered
+                except AttributeError:
+                    send_error(user_id, error='register')
+                #should be preventing duplicate game names here
+                except:
+                    send_error(user_id, error='gamename')
+        #formatting problems get grabbed here
+        else:
+            send_error(user_id, error='format')
     return None
 
 
-def send_user_tweet(user, image, game):
+def send_user_tweet(user, game, state, previous=None, turn=None,
+                    batch=None, mention_id=None):
+    """Queues user's tweet of the board for image string state, the
+    position after previous, in answer to mention mention_id. turn is whose
+    turn it was when the move was made, and defaults to the game's current
+    turn.
+    """
+    if turn is None:
+        turn = game.turn
+    if batch is None:
+        batch = Batch()
     api = get_api(user)
-    user = TwUser.get_by_id(game.owner).id
-    if game.turn == user:
-        opponent = TwUser.get_by_id(game.opponent).user_id
+    owner = batch.user(game.owner)
+    if turn == owner.id:
+        opponent = batch.user(game.opponent)
     else:
-        opponent = user
-    opponent = api.get_user(opponent).screen_name
+        opponent = owner
+    opponent = identities.cache.screen_name(opponent.user_id, api)
     tweet = u"@%s #%s" % (opponent, game.name)
-    api.update_with_media(image, status=tweet)
+    outbox.queue.enqueue(user.id, tweet, state, previous, mention_id)
     return
 
 
-def generate_filepath(image_string):
-    path = "chessnut/static/boards/%s.png" % image_string
-    return path
+def post_tweet(tweet):
+    """Posts an OutboundTweet, with its board if it has one. A board the
+    account has uploaded before is attached by its media id rather than
+    rendered and uploaded again.
+    """
+    api = get_api(TwUser.get_by_id(tweet.account))
+    if not tweet.board:
+        status = api.update_status(tweet.status)
+        timing.timings.mark(tweet.mention_id, 'posted')
+        return status
+    media_id = media.cache.get(tweet.account, tweet.board)
+    if media_id is not None:
+        try:
+            status = update_status(api, tweet.status, media_id)
+        except tweepy.TweepError as e:
+            if MEDIA_GONE not in error_codes(e):
+                raise
+            #gone from Twitter sooner than expected; upload it again
+            media.cache.forget(tweet.account, tweet.board)
+        else:
+            timing.timings.mark(tweet.mention_id, 'posted')
+            return status
+    image = board(tweet.board.encode(),
+                  tweet.previous.encode() if tweet.previous else None,
+                  buffer=True)
+    media_id = upload_media(api, image)
+    timing.timings.mark(tweet.mention_id, 'uploaded')
+    media.cache.put(tweet.account, tweet.board, media_id)
+    status = update_status(api, tweet.status, media_id)
+    timing.timings.mark(tweet.mention_id, 'posted')
+    return status
+
+
+def error_codes(error):
+    """Returns the Twitter error codes in TweepError error's reason."""
+    return [int(code) for code in
+            re.findall(r"""['"]code['"]: (\d+)""", error.reason)]
+
 
+def _multipart(image):
+    """Returns the headers and body of a form uploading the board in
+    buffer image as media.
+    """
+    filename = 'board.%s' % render_cache.cache.extension
+    file_type = mimetypes.guess_type(filename)[0]
+    boundary = 'Tw3ePy'
+    body = '\r\n'.join([
+        '--' + boundary,
+        'Content-Disposition: form-data; name="media"; filename="%s"'
+        % filename,
+        'Content-Type: %s' % file_type,
+        '',
+        image.read(),
+        '--' + boundary + '--',
+        '',
+    ])
+    headers = {
+        'Content-Type': 'multipart/form-data; boundary=%s' % boundary,
+        'Content-Length': str(len(body)),
+    }
+    return headers, body
 
-def send_challenge(user, opponent):
+
+def upload_media(api, image):
+    """Uploads the board in buffer image to upload_host for api's account
+    and returns its media id.
+    """
+    headers, body = _multipart(image)
+    uploads = tweepy.API(api.auth, host=upload_host, api_root=api_root,
+                         secure=api_secure)
+    return bind_api(
+        path='/media/upload.json',
+        method='POST',
+        payload_type='json',
+        require_auth=True,
+    )(uploads, headers=headers, post_data=body)['media_id_string']
+
+
+def update_status(api, status, media_id):
+    """Posts status with the uploaded media media_id attached."""
+    return bind_api(
+        path='/statuses/update.json',
+        method='POST',
+        payload_type='status',
+        allowed_param=['status', 'media_ids'],
+        require_auth=True,
+    )(api, status=status, media_ids=media_id)
+
+
+def send_challenge(user, opponent, batch=None, mention_id=None):
     """sends a challenge tweet to an opponent and an invitation to register if
     they are not an existing user"""
-    api = get_api(user)
-    c_api = cn_api()
-    opponent = api.get_user(opponent)
-    user = api.get_user(user)
-    challengetweet = u"@%s I'm challengeing you to a game of chess" % opponent.screen_name
-    if not TwUser.get_by_user_id(opponent.id):
-        newuser_tweet = u"@%s @%s has challenged you to a game of chess! Join by visiting %s" % (opponent.screen_name, user.screen_name, 'url goes here')
-        c_api.update_status(newuser_tweet)
-    api.update_status(challengetweet)
+    if batch is None:
+        batch = Batch()
+    challenger = batch.user_by_user_id(user)
+    api = get_api(challenger)
+    opponent_id = identities.cache.user_id(opponent, api)
+    user = identities.cache.screen_name(user, api)
+    challengetweet = u"@%s I'm challengeing you to a game of chess" % opponent
+    if not batch.user_by_user_id(opponent_id):
+        newuser_tweet = u"@%s @%s has challenged you to a game of chess! Join by visiting %s" % (opponent, user, 'url goes here')
+        outbox.queue.enqueue(BOT, newuser_tweet)
+    outbox.queue.enqueue(challenger.id, challengetweet,
+                         mention_id=mention_id)
     return
 
 
-def send_game_start(name, owner, opponent):
+def send_game_start(name, owner, opponent, mention_id=None):
     """sends start game tweet to owner and opponent"""
-    api = cn_api()
     tweet = u"The game begins at #%s. @%s has the first move. @%s is the opponent" % (name, owner, opponent)
-    api.update_status(tweet)
+    outbox.queue.enqueue(BOT, tweet, mention_id=mention_id)
     return
 
 
+#most characters in a tweet
+TWEET_LENGTH = 140
+
+error_dict = {
+    'default': u"There was a general error",
+    'register': u"you have to register to challenge people",
+    'gamename': u"that game name is already taken",
+    'format': u"Your last tweet had formatting issues",
+    'notyourgame': u"that is not your game",
+    'notyourturn': u"it isn't your turn yet",
+}
+
+
 def send_error(user, error='default'):
-    error_dict = {
-        'default': u"@%s There was a general error",
-        'register': u"@%s you have to register to challenge people",
-        'gamename': u"@%s that game name is already taken",
-        'format': u"@%s Your last tweet had formatting issues",
-        'notyourgame': u"@%s that is not your game",
-        'notyourturn': u"@%s it isn't your turn yet",
-    }
-    api = cn_api()
-    user = api.get_user(user)
-    user = user.screen_name
-    tweet = error_dict[error]
-    tweet = tweet % user
-    # api.update_status(tweet)
+    """owes a user an error reply, sent along with any others they're owed
+    by send_errors"""
+    error_replies.replies.add(user, error)
+    return None
+
+
+def send_errors():
+    """queues one reply to each user owed errors, in a transaction of its
+    own, listing as many as fit in a tweet; the rest wait for the next call.
+    Errors only count as told, starting their cooldowns, once the replies
+    are committed to the outbox"""
+    replies = error_replies.replies
+    owed = replies.take()
+    if not replies.post:
+        for user, errors in owed:
+            replies.told(user, errors)
+        return None
+    if not owed:
+        return None
+    sent = []
+    try:
+        with transaction.manager:
+            api = cn_api()
+            for user, errors in owed:
+                name = identities.cache.screen_name(user, api)
+                tweet, count = error_tweet(name, errors)
+                outbox.queue.enqueue(BOT, tweet)
+                sent.append((user, errors, count))
+    except Exception:
+        for user, errors in owed:
+            replies.restore(user, errors)
+        raise
+    for user, errors, count in sent:
+        replies.told(user, errors[:count])
+        if errors[count:]:
+            replies.restore(user, errors[count:])
     return None
+
+
+def error_tweet(name, errors):
+    """Returns the reply to screen name name listing as many of errors as
+    fit in a tweet, and how many that is."""
+    tweet = u"@%s %s" % (name, error_dict[errors[0]])
+    count = 1
+    for error in errors[1:]:
+        longer = u"%s; %s" % (tweet, error_dict[error])
+        if len(longer) > TWEET_LENGTH:
+            break
+        tweet, count = longer, count + 1
+    return tweet, count
@@ -3,20 +3,35 @@ from pyramid.view import view_config
 from .models import (
     DBSession,
     TwUser,
+    Game,
+    ProcessedTweet,
     SinceId
     )
 from .twitter import (
+    OAuthHandler,
+    clients,
+    cn_api,
     get_moves,
-    execute_moves,
+    new_api,
+    post_tweet,
     # media_tweet,
     # send_tweet,
     # send_error,
     )
 import transaction
 import tweepy
-from pyramid.httpexceptions import HTTPFound
+from pyramid.httpexceptions import HTTPFound, HTTPNotFound
+from pyramid.response import FileResponse
+from .replay import replay
+from . import identities, outbox, pipeline, timing
+from .mention_stream import MentionStream
+from .polling import PollSchedule
 from apscheduler.scheduler import Scheduler
-# from gevent.queue import Queue as gqueue
+from datetime import datetime, timedelta
+import logging
+import threading
+
+log = logging.getLogger(__name__)
 
 sched = Scheduler()
 sched.start()
@@ -24,14 +39,131 @@ sched.start()
 consumer_key = ''
 consumer_secret = ''
 
+#spacing of catch-up polls of the mentions timeline
+schedule = PollSchedule()
+stream = None
+#ids of tweets sent down the pipeline that since_id hasn't caught up to
+_queued = set()
+#waiters of tweets sent down the pipeline that may not all have been played
+_waiters = []
+#a tweet that fails to play is read again and retried by later polls, up
+#to PLAY_ATTEMPTS times in all; _attempts counts each one's failures
+PLAY_ATTEMPTS = 3
+_attempts = {}
+_processing = threading.Lock()
+#seconds late a poll may start and still run; apscheduler drops a date job
+#that misses its grace time, and with it every poll after
+POLL_GRACE = 86400
+#seconds a poll waits for its mentions to be played
+poll_wait = 300
+
 
-@sched.interval_schedule(seconds=90)
 def moves():
-    with transaction.manager:
-        since_id = SinceId.get_by_id(1)
-        value, tweet_queue = get_moves(since_id)
-        execute_moves(tweet_queue)
-        since_id.value = value
+    """catches up on mentions from the timeline, skipping any the stream
+    has already queued, and schedules the next poll"""
+    found, behind, rate = 0, False, (None, None, None)
+    try:
+        with transaction.manager:
+            since_id = SinceId.get_by_id(1)
+            value, tweet_queue, rate, behind = get_moves(since_id)
+            tweets = [tweet_queue.get() for i in xrange(tweet_queue.qsize())]
+            played = ProcessedTweet.processed_ids([t.id for t in tweets])
+        with _processing:
+            missed = [tweet for tweet in tweets
+                      if tweet.id not in _queued and tweet.id not in played]
+            _queued.update(tweet.id for tweet in missed)
+            waiter = pipeline.Waiter(missed)
+            _waiters.append(waiter)
+        #only tweets the stream hadn't delivered speed polling up
+        found = len(missed)
+        for tweet in missed:
+            timing.timings.received(tweet)
+            pipeline.mentions.put(tweet)
+        waiter.wait(poll_wait)
+        #since_id only moves on past tweets that have been played, this
+        #poll's or any still in the pipeline from the stream or before
+        with _processing:
+            unplayed = set()
+            for w in _waiters:
+                unplayed |= w.unplayed()
+                for tweet_id, why in w.take_unplayed().items():
+                    if why == 'failed':
+                        _attempts[tweet_id] = _attempts.get(tweet_id, 0) + 1
+                        if _attempts[tweet_id] >= PLAY_ATTEMPTS:
+                            #left in _queued so it isn't read again
+                            log.error("gave up playing tweet %s", tweet_id)
+                            continue
+                    _queued.discard(tweet_id)
+                    unplayed.add(tweet_id)
+            _waiters[:] = [w for w in _waiters if w.unplayed()]
+        if unplayed:
+            value = min(value, min(unplayed) - 1)
+        with transaction.manager:
+            SinceId.get_by_id(1).value = value
+            ProcessedTweet.prune(value)
+        with _processing:
+            for tweet_id in list(_queued):
+                if tweet_id <= value:
+                    _queued.discard(tweet_id)
+            for tweet_id in list(_attempts):
+                if tweet_id <= value:
+                    del _attempts[tweet_id]
+    finally:
+        #a walk held for lack of pages is carried on as soon as allowed
+        schedule_poll(schedule.update(found, *rate, behind=behind))
+
+
+def schedule_poll(seconds):
+    sched.add_date_job(moves, datetime.now() + timedelta(seconds=seconds),
+                       misfire_grace_time=POLL_GRACE)
+
+
+def stream_moves(tweet):
+    """sends a mention down the pipeline as soon as the stream delivers
+    it"""
+    with _processing:
+        with transaction.manager:
+            if tweet.id <= SinceId.get_by_id(1).value or \
+                    tweet.id in _queued or ProcessedTweet.seen(tweet.id):
+                return
+        _queued.add(tweet.id)
+        _waiters.append(pipeline.Waiter([tweet]))
+    timing.timings.received(tweet)
+    pipeline.mentions.put(tweet)
+
+
+def send_tweets():
+    """posts whatever replies are due from the outbox"""
+    outbox.queue.drain(post_tweet)
+
+
+def configure(settings):
+    """Schedules the first catch-up poll and, if twitter.stream is on,
+    opens the mention stream."""
+    global schedule, stream, poll_wait
+    streaming = settings.get('twitter.stream', 'false').lower() == 'true'
+    schedule = PollSchedule(
+        int(settings.get('twitter.poll_min_seconds') or 15),
+        int(settings.get('twitter.poll_max_seconds') or
+            (900 if streaming else 300)))
+    poll_wait = int(settings.get('twitter.poll_wait_seconds') or 300)
+    schedule_poll(schedule.interval)
+    sched.add_interval_job(
+        send_tweets, seconds=int(settings.get('outbox.interval') or 5))
+    if streaming:
+        with transaction.manager:
+            api = cn_api()
+            user_id = TwUser.get_by_id(1).user_id
+        port = settings.get('twitter.stream_port')
+        stream = MentionStream(
+            api.auth, user_id, stream_moves,
+            host=settings.get('twitter.stream_host',
+                              'userstream.twitter.com'),
+            port=int(port) if port else None,
+            secure=settings.get('twitter.stream_secure',
+                                'true').lower() == 'true')
+        stream.start()
+    return stream
 
 
 @view_config(route_name='login', renderer='string')
@@ -39,7 +171,7 @@ def get_auth(request):
     """talks to twitter api and retrieves request token and token secret"""
     if request.session.get('user_id', 0):
         return HTTPFound(location=request.route_url('index'))
-    auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
+    auth = OAuthHandler(consumer_key, consumer_secret)
     try:
         redirect_url = auth.get_authorization_url()
     except tweepy.TweepError:
@@ -57,8 +189,8 @@ def get_auth(request):
 def tw_auth(request):
     session = request.session
     verifier = request.GET.get('oauth_verifier')
-    auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
-    api = tweepy.API(auth)
+    auth = OAuthHandler(consumer_key, consumer_secret)
+    api = new_api(auth)
     token = session.get('request_token')
     del request.session['request_token']
     auth.set_request_token(token[0], token[1])
@@ -77,8 +209,11 @@ def tw_auth(request):
     if not user:
         user = TwUser(key, secret, twuser.id)
         DBSession.add(user)
+    identities.cache.remember(twuser.id, twuser.screen_name, user)
 
     user = TwUser.get_by_secret(secret)
+    #drop any client built on the user's old tokens
+    clients.invalidate(user.id)
 
     session['logged_in'] = True
     session['user_id'] = user.id
@@ -91,3 +226,22 @@ def logout(request):
     del request.session['user_id']
     request.session['logged_in'] = False
     return "Logged out, bra"
+
+
+@view_config(route_name='metrics', renderer='json')
+def metrics(request):
+    """reports how often mentions are polled for and how each stage of
+    processing them is keeping up"""
+    return {'polling': schedule.metrics(),
+            'pipeline': pipeline.mentions.metrics(),
+            'latency': timing.timings.metrics()}
+
+
+@view_config(route_name='replay')
+def game_replay(request):
+    """serves an animated replay of a game"""
+    game = Game.get_by_name(request.matchdict['name'])
+    if game is None:
+        raise HTTPNotFound()
+    return FileResponse(replay(game), request=request,
+                        content_type='image/gif')
@@ -20,7 +20,6 @@ requires = [
     'wtforms',
     'psycopg2',
     'pillow',
-    'gevent',
     'apscheduler',
     ]
 
@@ -48,5 +47,8 @@ setup(name='chessnut',
       main = chessnut:main
       [console_scripts]
       initialize_chessnut_db = chessnut.scripts.initializedb:main
+      migrate_chessnut_boards = chessnut.scripts.migrateboards:main
+      warm_chessnut_boards = chessnut.scripts.warmboards:main
+      load_test_chessnut = chessnut.scripts.loadtest:main
       """,
       )